@@ -0,0 +1,161 @@
+"""Precomputed eco-friendlier alternatives per product category.
+
+Build the table offline from an OpenFoodFacts CSV export
+(https://world.openfoodfacts.org/data, optionally gzipped):
+
+    python alternatives.py en.openfoodfacts.org.products.csv.gz --country en:india
+
+server.py loads the resulting JSON once and looks alternatives up in memory.
+"""
+import argparse
+import csv
+import gzip
+import heapq
+import json
+import logging
+import re
+import sys
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Best grade first; OpenFoodFacts uses "a-plus" for A+
+GRADES = ["a-plus", "a", "b", "c", "d", "e", "f"]
+GRADE_RANK = {grade: rank for rank, grade in enumerate(GRADES)}
+
+STOP_WORDS = {"and", "or", "of", "the", "with", "in", "for", "de", "en", "a", "g", "ml", "kg", "pack"}
+
+
+def tokenize(text: str) -> List[str]:
+    return [t for t in re.findall(r"[a-z]+", text.lower()) if len(t) > 1 and t not in STOP_WORDS]
+
+
+def normalize_grade(grade: str) -> Optional[str]:
+    """'A+', 'a-plus', 'Green-Score B' -> 'a-plus', 'b'; None if not a grade."""
+    grade = grade.strip().lower().split()[-1] if grade.strip() else ""
+    grade = grade.replace("+", "-plus")
+    return grade if grade in GRADE_RANK else None
+
+
+def _column(row: dict, *names: str) -> str:
+    for name in names:
+        if row.get(name):
+            return row[name]
+    return ""
+
+
+def build_table(export_path: Path, country: str, top_k: int = 10, keywords_per_category: int = 20) -> dict:
+    """Stream the export and keep the `top_k` best graded, most scanned products per main category."""
+    csv.field_size_limit(sys.maxsize)
+    opener = gzip.open if str(export_path).endswith(".gz") else open
+
+    best: Dict[str, list] = defaultdict(list)  # category -> heap of (-grade rank, score, scans, row, product)
+    names: Dict[str, str] = {}
+    keywords: Dict[str, Counter] = defaultdict(Counter)
+    rows = 0
+
+    with opener(export_path, "rt", encoding="utf-8", newline="") as f:
+        for row in csv.DictReader(f, delimiter="\t", quoting=csv.QUOTE_NONE):
+            rows += 1
+            if country not in _column(row, "countries_tags").split(","):
+                continue
+            category = _column(row, "main_category")
+            product_name = _column(row, "product_name", "product_name_en").strip()
+            if not category or not product_name:
+                continue
+
+            names.setdefault(category, _column(row, "main_category_en") or category.split(":", 1)[-1].replace("-", " "))
+            keywords[category].update(set(tokenize(product_name)))
+
+            grade = normalize_grade(_column(row, "environmental_score_grade", "ecoscore_grade"))
+            if grade is None:
+                continue
+            score = float(_column(row, "environmental_score_score", "ecoscore_score") or 0)
+            scans = int(float(_column(row, "unique_scans_n") or 0))
+            product = {
+                "code": row.get("code", ""),
+                "name": product_name,
+                "brands": _column(row, "brands"),
+                "grade": grade,
+            }
+            entry = (-GRADE_RANK[grade], score, scans, rows, product)
+            if len(best[category]) < top_k:
+                heapq.heappush(best[category], entry)
+            else:
+                heapq.heappushpop(best[category], entry)
+
+    categories = {}
+    for category, heap in best.items():
+        categories[category] = {
+            "name": names[category],
+            "keywords": [token for token, _ in keywords[category].most_common(keywords_per_category)],
+            "products": [entry[-1] for entry in sorted(heap, reverse=True)],
+        }
+    logger.info("Read %d rows, kept %d categories for %s", rows, len(categories), country)
+    return {"country": country, "categories": categories}
+
+
+class AlternativesTable:
+    """In-memory lookup of better graded products in the category matching a product name."""
+
+    def __init__(self, table: dict):
+        self.country = table.get("country")
+        self.categories = table["categories"]
+        self._index: Dict[str, Dict[str, float]] = defaultdict(dict)
+        for category, info in self.categories.items():
+            for token in info["keywords"]:
+                self._index[token][category] = 1.0
+            # Words of the category name itself are the strongest signal
+            for token in tokenize(info["name"]):
+                self._index[token][category] = 2.0
+
+    @classmethod
+    def load(cls, path: Path) -> "AlternativesTable":
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    def match_category(self, product_name: str) -> Optional[str]:
+        scores: Counter = Counter()
+        for token in set(tokenize(product_name)):
+            for category, weight in self._index.get(token, {}).items():
+                scores[category] += weight
+        if not scores:
+            return None
+        return scores.most_common(1)[0][0]
+
+    def better_alternatives(self, product_name: str, eco_score: str, limit: int = 3) -> List[dict]:
+        """Up to `limit` products of the matched category graded strictly better than `eco_score`.
+
+        Empty when `eco_score` isn't a known grade ("Eco-Score not found"),
+        since nothing can be said to be better than it.
+        """
+        grade = normalize_grade(eco_score)
+        if grade is None:
+            return []
+        category = self.match_category(product_name)
+        if category is None:
+            return []
+        rank = GRADE_RANK[grade]
+        products = [p for p in self.categories[category]["products"] if GRADE_RANK[p["grade"]] < rank]
+        return products[:limit]
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Build the eco-alternatives table from an OpenFoodFacts export")
+    parser.add_argument("export", type=Path, help="OpenFoodFacts CSV export (.csv or .csv.gz)")
+    parser.add_argument("--country", default="en:india", help="countries_tags value to keep")
+    parser.add_argument("--top-k", type=int, default=10, help="products kept per category")
+    parser.add_argument("--output", type=Path, default=Path("alternatives.json"))
+    args = parser.parse_args()
+
+    table = build_table(args.export, args.country, args.top_k)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(table, f, ensure_ascii=False, separators=(",", ":"))
+    logger.info("Wrote %s", args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+import logging
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+from flask import Flask, g, jsonify, request
+
+logger = logging.getLogger(__name__)
+
+# Endpoints that must keep answering when the service is saturated
+UNLIMITED_PATHS = ("/healthz", "/readyz", "/metrics/")
+
+
+class Overloaded(Exception):
+    def __init__(self, message: str, retry_after: float = 1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class Deadline:
+    """Time budget of one request, passed down to every stage that does I/O."""
+
+    def __init__(self, budget_seconds: float):
+        self.budget = budget_seconds
+        self.expires_at = time.monotonic() + budget_seconds
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def timeout(self, cap: float) -> float:
+        """Timeout for the next call: at most `cap`, never past the deadline."""
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise DeadlineExceeded(f"request deadline of {self.budget:.1f}s exceeded")
+        return min(cap, remaining)
+
+
+class StageLimiter:
+    """Bounds the number of requests inside one pipeline stage (OCR, search, LLM, ...).
+
+    A request waits at most `max_wait` seconds (and never past its deadline)
+    for a slot and is rejected with `Overloaded` otherwise, so a saturated
+    stage fails fast instead of queueing unbounded work. Running out of time
+    while waiting raises `DeadlineExceeded` instead.
+    """
+
+    def __init__(self, name: str, limit: int, max_wait: float = 1.0, retry_after: float = 2):
+        self.name = name
+        self.limit = limit
+        self.max_wait = max_wait
+        self.retry_after = retry_after
+        self._semaphore = threading.BoundedSemaphore(limit)
+
+    @contextmanager
+    def slot(self, deadline: Optional[Deadline] = None):
+        wait = deadline.timeout(self.max_wait) if deadline else self.max_wait
+        if not self._semaphore.acquire(timeout=wait):
+            if deadline and deadline.expired():
+                raise DeadlineExceeded(f"request deadline of {deadline.budget:.1f}s exceeded waiting for {self.name}")
+            raise Overloaded(f"{self.name} stage saturated ({self.limit} in flight)", retry_after=self.retry_after)
+        try:
+            yield
+        finally:
+            self._semaphore.release()
+
+
+def _retry_after_header(seconds: float) -> dict:
+    return {"Retry-After": str(max(1, math.ceil(seconds)))}
+
+
+def install_admission_control(app: Flask, max_in_flight: int, budget_seconds: float, retry_after: float = 1):
+    """Cap concurrent requests and give every request a `g.deadline`.
+
+    Requests beyond `max_in_flight` are rejected with 429, a stage raising
+    `Overloaded` turns into 503, and both carry a Retry-After header. Clients
+    may shorten (never extend) the budget with an X-Request-Timeout-Ms header.
+    """
+    admission = threading.BoundedSemaphore(max_in_flight)
+
+    @app.before_request
+    def admit():
+        if request.path.startswith(UNLIMITED_PATHS):
+            return None
+        if not admission.acquire(blocking=False):
+            logger.warning("Rejecting %s: %d requests already in flight", request.path, max_in_flight)
+            return jsonify({"error": "Too many requests"}), 429, _retry_after_header(retry_after)
+        g.admitted = True
+
+        budget = budget_seconds
+        timeout_ms = request.headers.get("X-Request-Timeout-Ms")
+        if timeout_ms:
+            try:
+                budget = min(budget, int(timeout_ms) / 1000)
+            except ValueError:
+                pass
+        g.deadline = Deadline(budget)
+        return None
+
+    @app.teardown_request
+    def release(exc):
+        if g.pop("admitted", False):
+            admission.release()
+
+    @app.errorhandler(Overloaded)
+    def overloaded(e: Overloaded):
+        logger.warning(f"Shedding request: {e}")
+        return jsonify({"error": str(e)}), 503, _retry_after_header(e.retry_after)
+
+    @app.errorhandler(DeadlineExceeded)
+    def deadline_exceeded(e: DeadlineExceeded):
+        logger.warning(f"Giving up on request: {e}")
+        return jsonify({"error": str(e)}), 504
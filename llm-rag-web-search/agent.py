@@ -0,0 +1,119 @@
+import logging
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Dict, List, Optional
+
+from pydantic import BaseModel
+
+from admission import DeadlineExceeded, Overloaded
+from utils import Scratchpad, StopWatch
+
+logger = logging.getLogger(__name__)
+
+# A tool gets the step input and the results of the steps it depends on
+Tool = Callable[[str, str], str]
+
+
+class Step(BaseModel):
+    name: str
+    tool: str
+    input: str
+    depends_on: List[str] = []
+
+
+class StepResult(BaseModel):
+    name: str
+    result: str
+    ok: bool
+    elapsed_ms: float
+    context: str = ""  # results of the dependencies the step was given
+
+
+def plan_product_query(product: str) -> List[Step]:
+    """Search and OpenFoodFacts lookup run side by side, the LLM answers from both."""
+    return [
+        Step(name="search", tool="search", input=product),
+        Step(name="eco_score", tool="off_lookup", input=product),
+        Step(name="answer", tool="llm", input=product, depends_on=["search", "eco_score"]),
+    ]
+
+
+def _check_plan(steps: List[Step], tools: Dict[str, Tool]):
+    names = {step.name for step in steps}
+    if len(names) != len(steps):
+        raise ValueError("step names must be unique")
+    for step in steps:
+        if step.tool not in tools:
+            raise ValueError(f"unknown tool (step='{step.name}', tool='{step.tool}')")
+        missing = set(step.depends_on) - names
+        if missing:
+            raise ValueError(f"unknown dependencies (step='{step.name}', depends_on={sorted(missing)})")
+
+    # Kahn's algorithm: every step must become ready at some point
+    remaining = {step.name: set(step.depends_on) for step in steps}
+    while remaining:
+        ready = [name for name, deps in remaining.items() if not deps]
+        if not ready:
+            raise ValueError(f"dependency cycle between steps {sorted(remaining)}")
+        for name in ready:
+            del remaining[name]
+        for deps in remaining.values():
+            deps.difference_update(ready)
+
+
+class AgentExecutor:
+    """Runs a plan of steps as a dependency graph, independent steps concurrently.
+
+    A step starts as soon as its dependencies are done and gets the results of
+    the successful ones as context; it is skipped only if all of them failed.
+    Each successful step is recorded in the scratchpad, and a run takes as
+    long as its critical path rather than the sum of its steps. `Overloaded`
+    and `DeadlineExceeded` abort the whole run instead of failing one step.
+    """
+
+    def __init__(self, tools: Dict[str, Tool], max_workers: int = 4):
+        self.tools = tools
+        self.max_workers = max_workers
+
+    def _run_step(self, step: Step, context: str) -> StepResult:
+        with StopWatch() as sw:
+            try:
+                result, ok = self.tools[step.tool](step.input, context), True
+            except (Overloaded, DeadlineExceeded):
+                raise
+            except Exception as e:
+                logger.error(f"Step '{step.name}' failed: {e}")
+                result, ok = f"Error: {e}", False
+        return StepResult(name=step.name, result=result, ok=ok, elapsed_ms=sw.elapsed(), context=context)
+
+    def run(self, steps: List[Step], scratchpad: Optional[Scratchpad] = None) -> Dict[str, StepResult]:
+        _check_plan(steps, self.tools)
+        scratchpad = scratchpad if scratchpad is not None else Scratchpad()
+        results: Dict[str, StepResult] = {}
+        waiting = list(steps)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            running = {}
+            while waiting or running:
+                for step in [s for s in waiting if all(dep in results for dep in s.depends_on)]:
+                    waiting.remove(step)
+                    succeeded = [dep for dep in step.depends_on if results[dep].ok]
+                    if step.depends_on and not succeeded:
+                        results[step.name] = StepResult(
+                            name=step.name, result="Skipped: all dependencies failed", ok=False, elapsed_ms=0.0
+                        )
+                        continue
+                    context = "\n".join(results[dep].result for dep in succeeded)
+                    running[executor.submit(self._run_step, step, context)] = step
+
+                if not running:
+                    # Newly skipped steps may have made others ready
+                    continue
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    step = running.pop(future)
+                    results[step.name] = future.result()
+                    if results[step.name].ok:
+                        scratchpad.add(task=f"{step.tool}({step.input})", result=results[step.name].result)
+
+        return results
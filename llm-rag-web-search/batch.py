@@ -0,0 +1,121 @@
+import argparse
+import json
+import logging
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import Callable, Iterable, List, Set
+
+from utils import StopWatch
+
+logger = logging.getLogger(__name__)
+
+
+def add_batch_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--batch", metavar="FILE", help="file with one item per line ('-' reads stdin)")
+    parser.add_argument("--output", default="answers.jsonl", help="JSONL file results are appended to")
+    parser.add_argument("--search-workers", type=int, default=8, help="concurrent SearxNG requests")
+    parser.add_argument("--llm-workers", type=int, default=2, help="concurrent Ollama requests")
+    parser.add_argument("--searxng-endpoint", default="http://127.0.0.1:8080/")
+
+
+def read_items(source: str) -> List[str]:
+    """Read non-empty, de-duplicated items from a file or from stdin ('-')."""
+    if source == "-":
+        lines = sys.stdin.read().splitlines()
+    else:
+        lines = Path(source).read_text(encoding="utf-8").splitlines()
+
+    items = (line.strip() for line in lines)
+    return list(dict.fromkeys(item for item in items if item))
+
+
+def completed_items(output_path: Path) -> Set[str]:
+    """Items that already have a successful answer in the output file."""
+    done = set()
+    if not output_path.exists():
+        return done
+
+    with open(output_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # Partially written last line of an interrupted run
+                continue
+            if "error" not in record:
+                done.add(record["item"])
+    return done
+
+
+def _ends_with_newline(path: Path) -> bool:
+    """True for an empty or missing file, or one whose last byte is a newline."""
+    if not path.exists() or path.stat().st_size == 0:
+        return True
+    with open(path, "rb") as f:
+        f.seek(-1, 2)
+        return f.read(1) == b"\n"
+
+
+def run_batch(
+    items: Iterable[str],
+    output_path: Path,
+    search: Callable[[str], str],
+    answer: Callable[[str, str], str],
+    search_workers: int = 8,
+    llm_workers: int = 2,
+) -> int:
+    """Answer every item and append one JSON line per item as soon as it finishes.
+
+    `search(item)` returns the context for an item and `answer(context, item)`
+    the LLM response; either may raise, which is recorded as an error line and
+    retried on the next run. Searches and LLM calls run in separate pools so
+    the LLM bound doesn't throttle the searches and vice versa.
+    """
+    output_path = Path(output_path)
+    done = completed_items(output_path)
+    pending = [item for item in items if item not in done]
+    logger.info("Processing %d items (%d already in %s)", len(pending), len(done), output_path)
+
+    write_lock = threading.Lock()
+    written = 0
+
+    with open(output_path, "a", encoding="utf-8") as out, StopWatch() as sw:
+        if not _ends_with_newline(output_path):
+            # Start after the partial line of an interrupted run, not on it
+            out.write("\n")
+
+        def write(record: dict):
+            nonlocal written
+            with write_lock:
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                out.flush()
+                written += 1
+                if written % 100 == 0:
+                    logger.info("Wrote %d/%d items in %.1f s", written, len(pending), sw.elapsed() / 1000)
+
+        def on_answer(future, item: str, context: str):
+            try:
+                write({"item": item, "context": context, "response": future.result()})
+            except Exception as e:
+                logger.error(f"Error answering '{item}': {e}")
+                write({"item": item, "error": str(e)})
+
+        with ThreadPoolExecutor(max_workers=search_workers) as search_pool, \
+                ThreadPoolExecutor(max_workers=llm_workers) as llm_pool:
+            search_futures = {search_pool.submit(search, item): item for item in pending}
+            for future in as_completed(search_futures):
+                item = search_futures[future]
+                try:
+                    context = future.result()
+                except Exception as e:
+                    logger.error(f"Error searching '{item}': {e}")
+                    write({"item": item, "error": str(e)})
+                    continue
+
+                llm_future = llm_pool.submit(answer, context, item)
+                llm_future.add_done_callback(lambda f, item=item, context=context: on_answer(f, item, context))
+
+    logger.info("Wrote %d items to %s in %.1f s", written, output_path, sw.elapsed() / 1000)
+    return written
@@ -0,0 +1,70 @@
+"""Throughput of utils.split_file / recombine_files against the previous sequential versions.
+
+Usage: python bench_split_files.py [size_mb] [chunk_mb] [workers]
+"""
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+from utils import StopWatch, recombine_files, split_file
+
+
+def split_file_sequential(file_path: Path, output_dir: Path, chunk_size: int) -> None:
+    output_dir.mkdir(parents=True, exist_ok=True)
+    with open(file_path, "rb") as input_file:
+        part_num = 0
+        while True:
+            chunk = input_file.read(chunk_size)
+            if not chunk:
+                break
+            part_num += 1
+            with open(output_dir / f"{part_num:04d}.part", "wb") as output_file:
+                output_file.write(chunk)
+
+
+def recombine_files_sequential(input_dir: Path, output_file: Path) -> None:
+    with open(output_file, "wb") as output:
+        for part in sorted(os.listdir(input_dir)):
+            with open(input_dir / part, "rb") as input_file:
+                output.write(input_file.read())
+
+
+def report(name: str, size_mb: int, sw: StopWatch):
+    seconds = sw.elapsed() / 1000
+    print(f"{name:<28} {seconds:8.2f} s {size_mb / seconds:10.1f} MB/s")
+
+
+def main():
+    size_mb = int(sys.argv[1]) if len(sys.argv) > 1 else 1024
+    chunk_mb = int(sys.argv[2]) if len(sys.argv) > 2 else 64
+    workers = int(sys.argv[3]) if len(sys.argv) > 3 else 4
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        source = tmp / "weights.bin"
+        with open(source, "wb") as f:
+            for _ in range(size_mb):
+                f.write(os.urandom(1024 * 1024))
+
+        print(f"{size_mb} MB file, {chunk_mb} MB parts, {workers} workers")
+
+        with StopWatch() as sw:
+            split_file_sequential(source, tmp / "parts-sequential", chunk_mb * 1024 * 1024)
+        report("split (sequential)", size_mb, sw)
+
+        with StopWatch() as sw:
+            split_file(source, tmp / "parts", chunk_mb * 1024 * 1024, workers=workers)
+        report("split (parallel, sha256)", size_mb, sw)
+
+        with StopWatch() as sw:
+            recombine_files_sequential(tmp / "parts-sequential", tmp / "sequential.bin")
+        report("recombine (sequential)", size_mb, sw)
+
+        with StopWatch() as sw:
+            recombine_files(tmp / "parts", tmp / "parallel.bin", workers=workers)
+        report("recombine (parallel, sha256)", size_mb, sw)
+
+
+if __name__ == "__main__":
+    main()
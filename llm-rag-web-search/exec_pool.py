@@ -0,0 +1,183 @@
+import logging
+import os
+import queue
+import resource
+import subprocess
+import sys
+import threading
+import time
+from multiprocessing.connection import Connection
+from typing import Any, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class ExecError(Exception):
+    pass
+
+
+def _worker_main(conn, cpu_seconds: int, memory_bytes: int):
+    """Worker loop: receive (code, result_variable_name), send back (status, value)."""
+    resource.setrlimit(resource.RLIMIT_AS, (memory_bytes, memory_bytes))
+    _, cpu_hard = resource.getrlimit(resource.RLIMIT_CPU)
+
+    while True:
+        try:
+            code, result_variable_name = conn.recv()
+        except EOFError:
+            return
+
+        # RLIMIT_CPU counts the whole process, so move the soft limit to
+        # `cpu_seconds` past what previous runs used. Exceeding it kills the worker.
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        soft = int(usage.ru_utime + usage.ru_stime) + cpu_seconds
+        if cpu_hard != resource.RLIM_INFINITY:
+            soft = min(soft, cpu_hard)
+        resource.setrlimit(resource.RLIMIT_CPU, (soft, cpu_hard))
+
+        try:
+            global_variables = {}  # type: ignore
+            exec(code, global_variables)
+            result = ("ok", global_variables[result_variable_name])
+        except BaseException as e:
+            result = ("error", repr(e))
+
+        try:
+            conn.send(result)
+        except Exception as e:
+            conn.send(("error", f"result could not be sent back: {e!r}"))
+
+
+class _PipeConnection:
+    """Duplex Connection-like object over a pair of one-way pipe file descriptors."""
+
+    def __init__(self, read_fd: int, write_fd: int):
+        self._reader = Connection(read_fd, writable=False)
+        self._writer = Connection(write_fd, readable=False)
+
+    def send(self, obj):
+        self._writer.send(obj)
+
+    def recv(self):
+        return self._reader.recv()
+
+    def poll(self, timeout: float) -> bool:
+        return self._reader.poll(timeout)
+
+    def close(self):
+        self._reader.close()
+        self._writer.close()
+
+
+class _Worker:
+    def __init__(self, process: subprocess.Popen, conn: _PipeConnection):
+        self.process = process
+        self.conn = conn
+        self.runs = 0
+
+
+class ExecPool:
+    """Pre-started worker processes that run untrusted code under resource limits.
+
+    Each worker is limited to `memory_mb` of address space and `cpu_seconds`
+    of CPU time per call, and a call is abandoned after `timeout` seconds of
+    wall-clock time. Workers are replaced after `max_runs` calls, on timeout
+    and on crash, so a runaway snippet never takes the caller down with it.
+
+    Workers are fresh `python -I` interpreters running this file rather than
+    multiprocessing children, which would re-import the caller's `__main__`
+    (and with it the Flask app and its warm-up) in every worker.
+    """
+
+    def __init__(
+        self,
+        size: int = 2,
+        cpu_seconds: int = 5,
+        memory_mb: int = 512,
+        timeout: float = 10,
+        max_runs: int = 100,
+    ):
+        self.cpu_seconds = cpu_seconds
+        self.memory_bytes = memory_mb * 1024 * 1024
+        self.timeout = timeout
+        self.max_runs = max_runs
+        self._idle = queue.Queue()
+        for _ in range(size):
+            self._idle.put(self._spawn())
+
+    def _spawn(self) -> _Worker:
+        # Our end of the pipes is one duplex Connection, the worker gets the other two fds
+        to_worker_r, to_worker_w = os.pipe()
+        from_worker_r, from_worker_w = os.pipe()
+        try:
+            process = subprocess.Popen(
+                [sys.executable, "-I", os.path.abspath(__file__),
+                 str(to_worker_r), str(from_worker_w), str(self.cpu_seconds), str(self.memory_bytes)],
+                stdin=subprocess.DEVNULL,
+                pass_fds=(to_worker_r, from_worker_w),
+            )
+        finally:
+            os.close(to_worker_r)
+            os.close(from_worker_w)
+        return _Worker(process, _PipeConnection(from_worker_r, to_worker_w))
+
+    def _retire(self, worker: _Worker):
+        worker.conn.close()
+        if worker.process.poll() is None:
+            worker.process.kill()
+        worker.process.wait()
+
+    def run(self, code: str, result_variable_name: str, timeout: Optional[float] = None) -> Any:
+        """Execute `code` in a worker and return its `result_variable_name` global."""
+        worker = self._idle.get()
+        recycle = False
+        start = time.perf_counter()
+        try:
+            worker.conn.send((code, result_variable_name))
+            if not worker.conn.poll(timeout or self.timeout):
+                recycle = True
+                raise ExecError(f"execution timed out after {timeout or self.timeout}s")
+            status, value = worker.conn.recv()
+        except (EOFError, OSError) as e:
+            recycle = True
+            try:
+                worker.process.wait(1)
+            except subprocess.TimeoutExpired:
+                pass
+            raise ExecError(f"worker died (exit code {worker.process.returncode}), resource limit exceeded?") from e
+        finally:
+            worker.runs += 1
+            if recycle or worker.runs >= self.max_runs:
+                self._retire(worker)
+                worker = self._spawn()
+            self._idle.put(worker)
+            logger.debug("exec finished in %.1f ms", (time.perf_counter() - start) * 1000)
+
+        if status == "error":
+            raise ExecError(value)
+        return value
+
+    def close(self):
+        while True:
+            try:
+                self._retire(self._idle.get_nowait())
+            except queue.Empty:
+                return
+
+
+_default_pool = None
+_default_pool_lock = threading.Lock()
+
+
+def get_default_exec_pool() -> ExecPool:
+    """Pool sized by EXEC_POOL_SIZE (default 2), created on first use."""
+    global _default_pool
+    with _default_pool_lock:
+        if _default_pool is None:
+            _default_pool = ExecPool(size=int(os.environ.get("EXEC_POOL_SIZE", 2)))
+        return _default_pool
+
+
+if __name__ == "__main__":
+    read_fd, write_fd, cpu_seconds, memory_bytes = map(int, sys.argv[1:5])
+    _worker_main(_PipeConnection(read_fd, write_fd), cpu_seconds, memory_bytes)
@@ -1,13 +1,19 @@
+import time
+_PROCESS_START = time.perf_counter()
+
 import re
 import requests
 import logging
-from flask import Flask, request, jsonify
+import os
+from flask import Flask, g, request, jsonify
 from typing import List, Tuple
-import json
 import uuid
-import numpy as np
 from utils import StopWatch
-from pyngrok import ngrok
+from agent import AgentExecutor, plan_product_query
+from admission import Deadline, DeadlineExceeded, StageLimiter, install_admission_control
+from serving import (
+    ERROR_RESPONSE, SHOPPING_SCHEMA, generate_answer, install_health_routes, start_warm_up, warm_up_models
+)
 
 # Logging configuration
 logging.basicConfig(level=logging.INFO)
@@ -26,23 +32,64 @@ Question: {question}
 
 Answer:"""
 
+# Admission control: requests beyond MAX_IN_FLIGHT get a 429, a saturated stage a 503
+MAX_IN_FLIGHT = int(os.environ.get("MAX_IN_FLIGHT", 32))
+REQUEST_BUDGET_SECONDS = float(os.environ.get("REQUEST_BUDGET_SECONDS", 40))
+SEARCH_STAGE = StageLimiter("searxng", int(os.environ.get("SEARCH_CONCURRENCY", 8)))
+OFF_STAGE = StageLimiter("openfoodfacts", int(os.environ.get("OFF_CONCURRENCY", 8)))
+
+# Per-call caps, further shortened by the request deadline
+SEARCH_TIMEOUT_SECONDS = 5
+OFF_TIMEOUT_SECONDS = 10
+
 # SearxNG search function
-def search_internet(query: str, searxng_endpoint: str, top_k: int = 5) -> List[dict]:
+def search_internet(query: str, searxng_endpoint: str, top_k: int = 5, deadline: Deadline = None) -> List[dict]:
     """Search the internet using SearxNG."""
-    try:
-        result = re.findall(r'\((.*?)\)', query)
-        query_final = f"Healthy {result[0]} brands in India" if result else query
+    deadline = deadline or Deadline(SEARCH_TIMEOUT_SECONDS)
+    with SEARCH_STAGE.slot(deadline):
+        try:
+            result = re.findall(r'\((.*?)\)', query)
+            query_final = f"Healthy {result[0]} brands in India" if result else query
+            response = requests.get(
+                f"{searxng_endpoint}/search",
+                params={"q": query_final, "format": "json"},
+                timeout=deadline.timeout(SEARCH_TIMEOUT_SECONDS)
+            )
+            response.raise_for_status()
+            results = response.json().get("results", [])
+            return results[:top_k]
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            if deadline.expired():
+                # The call was cut short by the request deadline, not a search failure
+                raise DeadlineExceeded(f"request deadline of {deadline.budget:.1f}s exceeded during search") from e
+            logger.error(f"Error during SearxNG search: {e}")
+            return []
+
+# OpenFoodFacts lookup of the most scanned matching product
+def lookup_eco_score(query: str, deadline: Deadline = None) -> str:
+    deadline = deadline or Deadline(OFF_TIMEOUT_SECONDS)
+    with OFF_STAGE.slot(deadline):
         response = requests.get(
-            f"{searxng_endpoint}/search",
-            params={"q": query_final, "format": "json"},
-            timeout=5
+            "https://world.openfoodfacts.org/cgi/search.pl",
+            params={
+                "action": "process",
+                "search_terms": query,
+                "sort_by": "unique_scans_n",
+                "page_size": 1,
+                "fields": "product_name,brands,ecoscore_grade",
+                "json": 1,
+            },
+            timeout=deadline.timeout(OFF_TIMEOUT_SECONDS)
         )
-        response.raise_for_status()
-        results = response.json().get("results", [])
-        return results[:top_k]
-    except Exception as e:
-        logger.error(f"Error during SearxNG search: {e}")
-        return []
+    response.raise_for_status()
+    products = response.json().get("products", [])
+    if not products:
+        raise ValueError(f"no OpenFoodFacts product found for '{query}'")
+    product = products[0]
+    grade = product.get("ecoscore_grade", "unknown").upper()
+    return f"{product.get('product_name', query)} by {product.get('brands', 'unknown brand')} has Eco-Score {grade}"
 
 # Fetch context documents
 def get_context_documents(
@@ -122,39 +169,23 @@ def process_results(results: List[dict], query: str) -> str:
     return context
 
 # Query local LLM using Ollama
-def query_ollama_local(context: str, question: str, model_name: str = "llama3.2") -> str:
-    """Generate a response locally using an Ollama model."""
+def query_ollama_local(
+    context: str,
+    question: str,
+    model_name: str = None,
+    deadline: Deadline = None,
+    schema: dict = None,
+    metadata: dict = None,
+):
+    """Generate a response locally using an Ollama model, see `serving.generate_answer`."""
     prompt = QA_USER_PROMPT_TEMPLATE.format(context=context, question=question)
-    try:
-        response = requests.post(
-            "http://127.0.0.1:11434/api/generate",
-            json={"model": model_name, "prompt": prompt},
-            timeout=30,
-            stream=True  # Enable streaming
-        )
-        response.raise_for_status()
-
-        # Process the streamed JSON lines
-        final_response = ""
-        for line in response.iter_lines():
-            if line:
-                try:
-                    json_line = json.loads(line)
-                    final_response += json_line.get("response", "")
-                except json.JSONDecodeError as e:
-                    logger.warning(f"Failed to parse JSON line: {line}. Error: {e}")
-
-        return final_response.strip()
-
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Request error querying Ollama: {e}")
-        return "Error generating a response."
-    except Exception as e:
-        logger.error(f"Unexpected error: {e}")
-        return "Error generating a response."
+    return generate_answer(prompt, model_name=model_name, deadline=deadline, schema=schema, metadata=metadata)
 
 # Flask app
 app = Flask(__name__)
+install_admission_control(app, MAX_IN_FLIGHT, REQUEST_BUDGET_SECONDS)
+install_health_routes(app)
+start_warm_up(warm_up_models, _PROCESS_START)
 
 @app.route('/query', methods=['POST'])
 def query():
@@ -164,19 +195,73 @@ def query():
         return jsonify({"error": "Empty query"}), 400
 
     searxng_endpoint = "http://127.0.0.1:8080/" 
-    results = search_internet(query, searxng_endpoint)
+    results = search_internet(query, searxng_endpoint, deadline=g.deadline)
     if not results:
         return jsonify({"error": "No results found"}), 404
 
     context = process_results(results, query)
-    response = query_ollama_local(context, query)
+    schema = SHOPPING_SCHEMA if data.get('format') == 'json' else None
+    llm_metadata = {}
+    response = query_ollama_local(context, query, deadline=g.deadline, schema=schema, metadata=llm_metadata)
 
     return jsonify({
         "context": context,
-        "response": response
+        "response": response,
+        "llm": llm_metadata
+    })
+
+@app.route('/agent', methods=['POST'])
+def agent_query():
+    data = request.json
+    query = data.get('query', '').strip()
+    if not query:
+        return jsonify({"error": "Empty query"}), 400
+
+    searxng_endpoint = "http://127.0.0.1:8080/"
+    deadline = g.deadline
+
+    def search(item: str, context: str) -> str:
+        results = search_internet(item, searxng_endpoint, deadline=deadline)
+        if not results:
+            raise ValueError("No results found")
+        return process_results(results, item)
+
+    llm_metadata = {}
+
+    def answer(item: str, context: str) -> str:
+        response = query_ollama_local(context, item, deadline=deadline, metadata=llm_metadata)
+        if response == ERROR_RESPONSE:
+            raise RuntimeError(response)
+        return response
+
+    executor = AgentExecutor({
+        "search": search,
+        "off_lookup": lambda item, context: lookup_eco_score(item, deadline),
+        "llm": answer,
+    })
+    with StopWatch() as sw:
+        results = executor.run(plan_product_query(query))
+    steps = [result.model_dump() for result in results.values()]
+
+    if not results["answer"].ok:
+        return jsonify({
+            "error": results["answer"].result,
+            "steps": steps,
+            "llm": llm_metadata,
+            "elapsed_ms": sw.elapsed()
+        }), 502
+
+    return jsonify({
+        "context": results["answer"].context,
+        "response": results["answer"].result,
+        "steps": steps,
+        "llm": llm_metadata,
+        "elapsed_ms": sw.elapsed()
     })
 
 if __name__ == "__main__":
+    from pyngrok import ngrok
+
     # Expose the Flask app locally
     public_url = ngrok.connect(5000).public_url
     print(f"Ngrok URL: {public_url}")
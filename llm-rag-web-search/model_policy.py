@@ -0,0 +1,158 @@
+import logging
+import math
+import os
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Optional
+
+from pydantic import BaseModel
+
+logger = logging.getLogger(__name__)
+
+# Largest / longest first; "model@num_predict", -1 leaves the length to the model
+DEFAULT_MODELS = "llama3.2@-1"
+
+
+class ModelTier(BaseModel):
+    model: str
+    num_predict: int = -1
+
+
+class ModelChoice(BaseModel):
+    model: str
+    num_predict: int
+    reason: str
+
+
+def parse_tiers(spec: str) -> List[ModelTier]:
+    """'llama3.2:3b@512,llama3.2:1b@256' -> tiers, largest first."""
+    tiers = []
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        model, _, num_predict = item.partition("@")
+        tiers.append(ModelTier(model=model, num_predict=int(num_predict) if num_predict else -1))
+    if not tiers:
+        raise ValueError(f"no models configured (spec='{spec}')")
+    return tiers
+
+
+def _p95(samples) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(latency for _, latency in samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+
+def _expire(samples: deque, oldest: float):
+    while samples and samples[0][0] < oldest:
+        samples.popleft()
+
+
+class AdaptiveModelPolicy:
+    """Picks the model and generation length of a request from the current load.
+
+    Tiers are ordered from most to least expensive. Every `queue_depth_step`
+    requests in flight per backend, and a recent p95 latency above
+    `max_p95_ms`, each move the request one tier down. A tier whose own p95
+    doesn't fit in the request's remaining time is skipped as well; if even
+    the last tier doesn't fit, its `num_predict` is scaled down to the time left.
+
+    Latencies are those of completed generations; a generation that timed out
+    or was cut off at the deadline counts as infinitely slow. Samples expire
+    after `sample_ttl_seconds`, and every `probe_every`-th time a tier is
+    skipped for its p95 it is used anyway, so one slow sample (e.g. a cold
+    model load) can't lock a tier out while only smaller tiers get new samples.
+    """
+
+    def __init__(
+        self,
+        tiers: List[ModelTier],
+        queue_depth_step: float = 2,
+        max_p95_ms: float = 20000,
+        min_num_predict: int = 64,
+        latency_window: int = 100,
+        sample_ttl_seconds: float = 300,
+        probe_every: int = 20,
+    ):
+        self.tiers = tiers
+        self.queue_depth_step = queue_depth_step
+        self.max_p95_ms = max_p95_ms
+        self.min_num_predict = min_num_predict
+        self.sample_ttl_seconds = sample_ttl_seconds
+        self.probe_every = probe_every
+        self._lock = threading.Lock()
+        self._latencies: Dict[str, deque] = {}  # model -> (monotonic time, ms)
+        self._recent = deque(maxlen=latency_window)
+        self._latency_window = latency_window
+        self._skips: Dict[str, int] = {}
+
+    def record(self, model: str, latency_ms: float):
+        """Generation time of a completed generation, without queueing for a slot."""
+        sample = (time.monotonic(), latency_ms)
+        with self._lock:
+            self._latencies.setdefault(model, deque(maxlen=self._latency_window)).append(sample)
+            self._recent.append(sample)
+
+    def record_timeout(self, model: str):
+        """A generation that timed out or was cut off at the deadline."""
+        self.record(model, math.inf)
+
+    def choose(self, queue_depth: float, remaining_seconds: Optional[float] = None) -> ModelChoice:
+        with self._lock:
+            oldest = time.monotonic() - self.sample_ttl_seconds
+            _expire(self._recent, oldest)
+            for samples in self._latencies.values():
+                _expire(samples, oldest)
+            recent_p95 = _p95(self._recent)
+            tier_p95 = [_p95(self._latencies.get(tier.model, ())) for tier in self.tiers]
+
+        reasons = []
+        level = int(queue_depth // self.queue_depth_step)
+        if level:
+            reasons.append(f"queue depth {queue_depth:.1f}")
+        if recent_p95 > self.max_p95_ms:
+            level += 1
+            reasons.append(f"p95 {recent_p95:.0f} ms > {self.max_p95_ms:.0f} ms")
+        level = min(level, len(self.tiers) - 1)
+
+        probing = False
+        if remaining_seconds is not None:
+            remaining_ms = remaining_seconds * 1000
+            while level < len(self.tiers) - 1 and tier_p95[level] > remaining_ms:
+                model = self.tiers[level].model
+                with self._lock:
+                    self._skips[model] = self._skips.get(model, 0) + 1
+                    probing = self._skips[model] % self.probe_every == 0
+                if probing:
+                    reasons.append(f"probing {model} (p95 {tier_p95[level]:.0f} ms > {remaining_ms:.0f} ms left)")
+                    break
+                reasons.append(f"{model} p95 {tier_p95[level]:.0f} ms > {remaining_ms:.0f} ms left")
+                level += 1
+
+        tier = self.tiers[level]
+        num_predict = tier.num_predict
+        if remaining_seconds is not None and num_predict > 0 and not probing and tier_p95[level] > remaining_seconds * 1000:
+            num_predict = max(self.min_num_predict, int(num_predict * remaining_seconds * 1000 / tier_p95[level]))
+            reasons.append(f"num_predict cut to {num_predict} for {remaining_seconds:.1f}s left")
+
+        return ModelChoice(model=tier.model, num_predict=num_predict, reason="; ".join(reasons) or "normal load")
+
+
+_default_policy = None
+_default_policy_lock = threading.Lock()
+
+
+def get_default_policy() -> AdaptiveModelPolicy:
+    """Policy over the OLLAMA_MODELS tiers, created on first use."""
+    global _default_policy
+    with _default_policy_lock:
+        if _default_policy is None:
+            _default_policy = AdaptiveModelPolicy(
+                parse_tiers(os.environ.get("OLLAMA_MODELS", DEFAULT_MODELS)),
+                queue_depth_step=float(os.environ.get("OLLAMA_QUEUE_DEPTH_STEP", 2)),
+                max_p95_ms=float(os.environ.get("OLLAMA_MAX_P95_MS", 20000)),
+            )
+        return _default_policy
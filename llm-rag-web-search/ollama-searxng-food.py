@@ -1,11 +1,13 @@
+import argparse
 import re
 import requests
 import logging
 from typing import List, Tuple
-import json
 import uuid
 import numpy as np
 from utils import StopWatch
+from ollama_client import NoBackendAvailable, get_default_pool
+from batch import add_batch_arguments, read_items, run_batch
 
 # Logging configuration
 logging.basicConfig(level=logging.INFO)
@@ -124,35 +126,51 @@ def query_ollama_local(context: str, question: str, model_name: str = "llama3.2"
     """Generate a response locally using an Ollama model."""
     prompt = QA_USER_PROMPT_TEMPLATE.format(context=context, question=question)
     try:
-        response = requests.post(
-            "http://127.0.0.1:11434/api/generate",
-            json={"model": model_name, "prompt": prompt},
-            timeout=30,
-            stream=True  # Enable streaming
-        )
-        response.raise_for_status()
+        payload = {"model": model_name, "prompt": prompt}
 
-        # Process the streamed JSON lines
+        # Streamed from the least loaded Ollama backend
         final_response = ""
-        for line in response.iter_lines():
-            if line:
-                try:
-                    json_line = json.loads(line)
-                    final_response += json_line.get("response", "")
-                except json.JSONDecodeError as e:
-                    logger.warning(f"Failed to parse JSON line: {line}. Error: {e}")
+        for chunk in get_default_pool().generate(payload, timeout=30):
+            final_response += chunk.get("response", "")
 
         return final_response.strip()
 
-    except requests.exceptions.RequestException as e:
+    except (requests.exceptions.RequestException, NoBackendAvailable) as e:
         logger.error(f"Request error querying Ollama: {e}")
         return "Error generating a response."
     except Exception as e:
         logger.error(f"Unexpected error: {e}")
         return "Error generating a response."
 
+def build_context(query: str, searxng_endpoint: str) -> str:
+    """Search for the item and build the LLM context, raising if nothing was found."""
+    results = search_internet(query, searxng_endpoint)
+    if not results:
+        raise ValueError("No results found")
+    return process_results(results, query)
+
+def answer(context: str, query: str) -> str:
+    response = query_ollama_local(context, query)
+    if response == "Error generating a response.":
+        raise RuntimeError(response)
+    return response
+
 def main():
-    searxng_endpoint = "http://127.0.0.1:8080/"  # Replace with your SearxNG instance
+    parser = argparse.ArgumentParser(description="Eco-shopping assistant using SearxNG and Ollama")
+    add_batch_arguments(parser)
+    args = parser.parse_args()
+    searxng_endpoint = args.searxng_endpoint
+
+    if args.batch:
+        run_batch(
+            read_items(args.batch),
+            args.output,
+            search=lambda item: build_context(item, searxng_endpoint),
+            answer=answer,
+            search_workers=args.search_workers,
+            llm_workers=args.llm_workers,
+        )
+        return
 
     query = input("Enter the item: ").strip()
     if not query:
@@ -0,0 +1,269 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Iterator, List, Optional
+
+import requests
+
+from utils import JsonStreamParser, missing_required
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BACKENDS = "http://127.0.0.1:11434"
+
+
+class NoBackendAvailable(Exception):
+    pass
+
+
+class OllamaBackend:
+    def __init__(self, url: str, latency_window: int = 200):
+        self.url = url.rstrip("/")
+        self.in_flight = 0
+        self.healthy = True
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self.requests = 0
+        self.failures = 0
+        self.latencies = deque(maxlen=latency_window)  # ms per completed generation
+
+    def available(self, now: float) -> bool:
+        return self.healthy and now >= self.open_until
+
+    def mean_latency(self) -> float:
+        return sum(self.latencies) / len(self.latencies) if self.latencies else 0.0
+
+    def p95_latency(self) -> float:
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+    def metrics(self) -> dict:
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "circuit_open": time.monotonic() < self.open_until,
+            "in_flight": self.in_flight,
+            "requests": self.requests,
+            "failures": self.failures,
+            "latency_ms_mean": round(self.mean_latency(), 1),
+            "latency_ms_p95": round(self.p95_latency(), 1),
+        }
+
+
+class OllamaPool:
+    """Routes Ollama generations across several backends.
+
+    Each request goes to the available backend with the fewest outstanding
+    requests (ties broken by mean latency). A backend that fails
+    `failure_threshold` times in a row is skipped for `cooldown_seconds`, and a
+    background thread marks backends unhealthy while `/api/tags` doesn't answer.
+    A request that fails before its first token is retried on another backend.
+    Only 5xx responses, connection errors and timeouts count as backend
+    failures; a 4xx (e.g. a model that isn't pulled) goes straight to the caller.
+    """
+
+    def __init__(
+        self,
+        urls: List[str],
+        health_check_interval: float = 5.0,
+        failure_threshold: int = 3,
+        cooldown_seconds: float = 10.0,
+    ):
+        if not urls:
+            raise ValueError("at least one Ollama backend is required")
+        self.backends = [OllamaBackend(url) for url in urls]
+        self.health_check_interval = health_check_interval
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self._lock = threading.Lock()
+        self._health_thread = None
+
+    def start_health_checks(self):
+        with self._lock:
+            if self._health_thread is None:
+                self._health_thread = threading.Thread(target=self._health_loop, name="ollama-health", daemon=True)
+                self._health_thread.start()
+
+    def _health_loop(self):
+        while True:
+            for backend in self.backends:
+                self.check_health(backend)
+            time.sleep(self.health_check_interval)
+
+    def check_health(self, backend: OllamaBackend) -> bool:
+        try:
+            requests.get(f"{backend.url}/api/tags", timeout=2).raise_for_status()
+            healthy = True
+        except requests.exceptions.RequestException:
+            healthy = False
+
+        with self._lock:
+            if healthy and not backend.healthy:
+                logger.info("Ollama backend %s is healthy again", backend.url)
+            elif not healthy and backend.healthy:
+                logger.warning("Ollama backend %s failed its health check", backend.url)
+            backend.healthy = healthy
+        return healthy
+
+    def _acquire(self, exclude: set) -> OllamaBackend:
+        with self._lock:
+            now = time.monotonic()
+            candidates = [b for b in self.backends if b not in exclude and b.available(now)]
+            if not candidates:
+                raise NoBackendAvailable(f"no Ollama backend available ({len(exclude)} tried)")
+            backend = min(candidates, key=lambda b: (b.in_flight, b.mean_latency()))
+            backend.in_flight += 1
+            backend.requests += 1
+            return backend
+
+    def _release(self, backend: OllamaBackend, latency_ms: Optional[float], failed: Optional[bool]):
+        """`failed=None` is an outcome that says nothing about the backend, e.g. a caller's deadline."""
+        with self._lock:
+            backend.in_flight -= 1
+            if failed is None:
+                return
+            if failed:
+                backend.failures += 1
+                backend.consecutive_failures += 1
+                if backend.consecutive_failures >= self.failure_threshold:
+                    backend.open_until = time.monotonic() + self.cooldown_seconds
+                    logger.warning("Opening circuit for Ollama backend %s for %.0fs", backend.url, self.cooldown_seconds)
+            else:
+                backend.consecutive_failures = 0
+                if latency_ms is not None:
+                    backend.latencies.append(latency_ms)
+
+    def generate(self, payload: dict, timeout: float = 30, deadline=None) -> Iterator[dict]:
+        """Stream the JSON chunks of `/api/generate` from the least loaded backend.
+
+        Closing the returned generator early cancels the generation. A stream
+        that ends without a final `"done": true` chunk raises
+        `ChunkedEncodingError` instead of passing for a complete answer. When
+        no backend is left to retry on, the last backend's error is raised.
+
+        With an `admission.Deadline`, each attempt's timeout is `timeout`
+        shortened to the time left, there is no retry once it has expired, and
+        a timeout caused by the deadline doesn't count against the backend.
+        """
+        self.start_health_checks()
+        tried = set()
+        last_error = None
+        while True:
+            if last_error is not None and deadline is not None and deadline.expired():
+                raise last_error
+            attempt_timeout = deadline.timeout(timeout) if deadline is not None else timeout
+            try:
+                backend = self._acquire(tried)
+            except NoBackendAvailable:
+                # Every backend was tried: the caller needs to know why the last one failed
+                if last_error is not None:
+                    raise last_error
+                raise
+            tried.add(backend)
+            start = time.perf_counter()
+            received_first_token = False
+            completed = False
+            failed = False
+            try:
+                with requests.post(
+                    f"{backend.url}/api/generate", json=payload, timeout=attempt_timeout, stream=True
+                ) as response:
+                    response.raise_for_status()
+                    for line in response.iter_lines():
+                        if not line:
+                            continue
+                        try:
+                            chunk = json.loads(line)
+                        except json.JSONDecodeError as e:
+                            logger.warning(f"Failed to parse JSON line: {line}. Error: {e}")
+                            continue
+                        received_first_token = True
+                        completed = chunk.get("done") is True
+                        yield chunk
+                if not completed:
+                    raise requests.exceptions.ChunkedEncodingError(
+                        f"Ollama backend {backend.url} closed the stream before the final chunk"
+                    )
+                return
+            except requests.exceptions.RequestException as e:
+                if e.response is not None and e.response.status_code < 500:
+                    # The request itself is wrong, another backend won't answer differently
+                    raise
+                # A read timeout mid-stream surfaces as a ConnectionError
+                cut_by_deadline = (
+                    attempt_timeout < timeout
+                    and deadline.expired()
+                    and isinstance(e, (requests.exceptions.Timeout, requests.exceptions.ConnectionError))
+                )
+                failed = None if cut_by_deadline else True
+                if received_first_token:
+                    raise
+                last_error = e
+                logger.warning(f"Ollama backend {backend.url} failed before the first token, retrying elsewhere: {e}")
+            finally:
+                latency_ms = (time.perf_counter() - start) * 1000
+                self._release(backend, latency_ms if completed else None, failed)
+
+    def generate_json(self, payload: dict, schema: dict, timeout: float = 30, deadline=None) -> dict:
+        """Generate an object constrained to `schema` and stop as soon as it is complete.
+
+        The schema is sent as Ollama's `format`, and the stream is parsed as it
+        arrives; the generation is cancelled once an object with all the
+        schema's required keys has been received instead of waiting for the
+        model to stop.
+        """
+        parser = JsonStreamParser()
+        stream = self.generate({**payload, "format": schema}, timeout=timeout, deadline=deadline)
+        try:
+            for chunk in stream:
+                obj = parser.feed(chunk.get("response", ""))
+                if obj is None:
+                    continue
+                missing = missing_required(obj, schema)
+                if not missing:
+                    return obj
+                logger.warning(f"Ignoring JSON object without required keys {missing}")
+        finally:
+            stream.close()
+        raise ValueError(f"json could not be extracted (input='{parser.buffer}')")
+
+    def warm_up(self, model_name: str, keep_alive: str, timeout: float = 120):
+        """Load the model on every backend; a generate request without a prompt only loads it."""
+        for backend in self.backends:
+            response = requests.post(
+                f"{backend.url}/api/generate",
+                json={"model": model_name, "keep_alive": keep_alive},
+                timeout=timeout,
+            )
+            response.raise_for_status()
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return sum(b.in_flight for b in self.backends)
+
+    def queue_depth(self) -> float:
+        """Requests in flight per backend."""
+        return self.in_flight() / len(self.backends)
+
+    def metrics(self) -> List[dict]:
+        with self._lock:
+            return [b.metrics() for b in self.backends]
+
+
+_default_pool = None
+_default_pool_lock = threading.Lock()
+
+
+def get_default_pool() -> OllamaPool:
+    """Pool over the comma-separated OLLAMA_BACKENDS urls, created on first use."""
+    global _default_pool
+    with _default_pool_lock:
+        if _default_pool is None:
+            urls = [url.strip() for url in os.environ.get("OLLAMA_BACKENDS", DEFAULT_BACKENDS).split(",") if url.strip()]
+            _default_pool = OllamaPool(urls)
+        return _default_pool
@@ -0,0 +1,179 @@
+import logging
+import os
+import threading
+import time
+from typing import Callable
+
+import requests
+from flask import Flask, jsonify
+
+from admission import Deadline, Overloaded, StageLimiter
+from model_policy import ModelChoice, get_default_policy
+from ollama_client import NoBackendAvailable, get_default_pool
+from utils import StopWatch, schema_instructions
+
+logger = logging.getLogger(__name__)
+
+OLLAMA_KEEP_ALIVE = os.environ.get("OLLAMA_KEEP_ALIVE", "30m")
+PRELOAD = os.environ.get("PRELOAD", "0") == "1"
+WARM_UP_RETRY_SECONDS = 5
+
+# A saturated LLM stage answers 503 instead of queueing
+LLM_STAGE = StageLimiter("ollama", int(os.environ.get("LLM_CONCURRENCY", 4)))
+LLM_TIMEOUT_SECONDS = 30  # per-call cap, further shortened by the request deadline
+LLM_MIN_SECONDS = 2  # skip generation when less time than this is left
+
+ERROR_RESPONSE = "Error generating a response."
+
+# Schema of the structured (format=json) shopping answer
+SHOPPING_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "recipe": {
+            "type": "object",
+            "properties": {
+                "name": {"type": "string", "description": "name of the homemade alternative"},
+                "ingredients": {"type": "array", "items": {"type": "string", "description": "ingredient with quantity"}},
+                "steps": {"type": "array", "items": {"type": "string", "description": "preparation step"}},
+            },
+            "required": ["name", "ingredients", "steps"],
+        },
+        "brands": {
+            "type": "array",
+            "items": {"type": "string", "description": "brand selling a healthier alternative in India"},
+        },
+    },
+    "required": ["recipe", "brands"],
+}
+
+
+def generate_answer(
+    prompt: str,
+    model_name: str = None,
+    deadline: Deadline = None,
+    schema: dict = None,
+    metadata: dict = None,
+):
+    """Generate the answer to `prompt` with Ollama.
+
+    With a JSON `schema` the answer is generated as a schema-constrained object
+    and returned as a dict (None on failure) instead of text. Without
+    `model_name` the model and length are picked from the current load, and
+    the choice is written to `metadata`.
+    """
+    if schema is not None:
+        prompt += "\n\n" + schema_instructions(schema)
+    error_response = None if schema is not None else ERROR_RESPONSE
+
+    deadline = deadline or Deadline(LLM_TIMEOUT_SECONDS)
+    if deadline.remaining() < LLM_MIN_SECONDS:
+        logger.warning("Skipping generation, only %.1fs left before the deadline", deadline.remaining())
+        return error_response
+    # Smaller model or shorter generation under load instead of timing out
+    if model_name is None:
+        choice = get_default_policy().choose(get_default_pool().queue_depth(), deadline.remaining())
+    else:
+        choice = ModelChoice(model=model_name, num_predict=-1, reason="requested")
+    if metadata is not None:
+        metadata.update(choice.model_dump())
+    logger.info("Generating with %s (num_predict=%d): %s", choice.model, choice.num_predict, choice.reason)
+
+    try:
+        payload = {"model": choice.model, "prompt": prompt, "keep_alive": OLLAMA_KEEP_ALIVE}
+        if choice.num_predict > 0:
+            payload["options"] = {"num_predict": choice.num_predict}
+
+        # Only the generation itself is timed for the policy, not the wait for a slot
+        if schema is not None:
+            # Generation is cancelled as soon as the object is complete
+            with LLM_STAGE.slot(deadline):
+                with StopWatch() as sw:
+                    result = get_default_pool().generate_json(payload, schema, timeout=LLM_TIMEOUT_SECONDS, deadline=deadline)
+            get_default_policy().record(choice.model, sw.elapsed())
+            return result
+
+        # Streamed from the least loaded Ollama backend, cut short at the deadline
+        final_response = ""
+        truncated = False
+        with LLM_STAGE.slot(deadline):
+            with StopWatch() as sw:
+                for chunk in get_default_pool().generate(payload, timeout=LLM_TIMEOUT_SECONDS, deadline=deadline):
+                    final_response += chunk.get("response", "")
+                    if deadline.expired():
+                        logger.warning("Deadline reached, returning a truncated response")
+                        truncated = True
+                        break
+        if truncated:
+            get_default_policy().record_timeout(choice.model)
+        else:
+            get_default_policy().record(choice.model, sw.elapsed())
+
+        return final_response.strip()
+
+    except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
+        # A read timeout mid-stream surfaces as a ConnectionError
+        if isinstance(e, requests.exceptions.Timeout) or deadline.expired():
+            get_default_policy().record_timeout(choice.model)
+            logger.error(f"Timeout querying Ollama: {e}")
+        else:
+            logger.error(f"Request error querying Ollama: {e}")
+        return error_response
+    except (requests.exceptions.RequestException, NoBackendAvailable) as e:
+        logger.error(f"Request error querying Ollama: {e}")
+        return error_response
+    except Overloaded:
+        raise
+    except Exception as e:
+        logger.error(f"Unexpected error: {e}")
+        return error_response
+
+
+# Warm-up and readiness
+_ready = threading.Event()
+_startup_ms = None
+
+
+def warm_up_models() -> None:
+    """Load every configured Ollama model so the first request doesn't pay for it."""
+    for model_name in dict.fromkeys(tier.model for tier in get_default_policy().tiers):
+        get_default_pool().warm_up(model_name, OLLAMA_KEEP_ALIVE)
+
+
+def _warm_up_until_ready(warm_up: Callable[[], None], process_start: float):
+    global _startup_ms
+    while not _ready.is_set():
+        try:
+            with StopWatch() as sw:
+                warm_up()
+            _startup_ms = (time.perf_counter() - process_start) * 1000
+            logger.info("Warm-up finished in %.1f ms, ready %.1f ms after process start", sw.elapsed(), _startup_ms)
+            _ready.set()
+        except Exception as e:
+            logger.error(f"Warm-up failed, retrying in {WARM_UP_RETRY_SECONDS}s: {e}")
+            time.sleep(WARM_UP_RETRY_SECONDS)
+
+
+def start_warm_up(warm_up: Callable[[], None], process_start: float):
+    """Run `warm_up` in the background with PRELOAD=1; otherwise the instance is ready immediately."""
+    if PRELOAD:
+        threading.Thread(target=_warm_up_until_ready, args=(warm_up, process_start), name="warm-up", daemon=True).start()
+    else:
+        _ready.set()
+
+
+def install_health_routes(app: Flask):
+    """/healthz (process is up), /readyz (warm-up finished) and /metrics/ollama."""
+
+    @app.route("/healthz", methods=["GET"])
+    def healthz():
+        return jsonify({"status": "ok"})
+
+    @app.route("/readyz", methods=["GET"])
+    def readyz():
+        if not _ready.is_set():
+            return jsonify({"ready": False}), 503
+        return jsonify({"ready": True, "preloaded": PRELOAD, "startup_ms": _startup_ms})
+
+    @app.route("/metrics/ollama", methods=["GET"])
+    def ollama_metrics():
+        return jsonify({"backends": get_default_pool().metrics()})
@@ -0,0 +1,100 @@
+import threading
+import time
+
+import pytest
+
+import admission
+from admission import Deadline, DeadlineExceeded, Overloaded, StageLimiter
+
+
+class FakeClock:
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(admission.time, "monotonic", clock)
+    return clock
+
+
+def test_deadline_timeout_is_capped_by_the_time_left(clock):
+    deadline = Deadline(10)
+    assert deadline.timeout(5) == 5
+
+    clock.now += 8
+    assert deadline.remaining() == pytest.approx(2)
+    assert deadline.timeout(5) == pytest.approx(2)
+    assert not deadline.expired()
+
+
+def test_expired_deadline_gives_no_timeout(clock):
+    deadline = Deadline(10)
+    clock.now += 10
+
+    assert deadline.expired()
+    assert deadline.remaining() == 0
+    with pytest.raises(DeadlineExceeded):
+        deadline.timeout(5)
+
+
+def hold_slots(limiter: StageLimiter, count: int) -> threading.Event:
+    """Occupy `count` slots of `limiter` until the returned event is set."""
+    release = threading.Event()
+    entered = threading.Barrier(count + 1)
+
+    def hold():
+        with limiter.slot():
+            entered.wait()
+            release.wait()
+
+    for _ in range(count):
+        threading.Thread(target=hold, daemon=True).start()
+    entered.wait()
+    return release
+
+
+def test_slot_is_released_on_exit():
+    limiter = StageLimiter("test", 1, max_wait=0.05)
+    for _ in range(3):
+        with limiter.slot():
+            pass
+
+
+def test_saturated_stage_is_overloaded():
+    limiter = StageLimiter("test", 2, max_wait=0.05, retry_after=7)
+    release = hold_slots(limiter, 2)
+    try:
+        with pytest.raises(Overloaded, match="test stage saturated") as e:
+            with limiter.slot(Deadline(10)):
+                pass
+        assert e.value.retry_after == 7
+    finally:
+        release.set()
+
+
+def test_running_out_of_time_while_waiting_exceeds_the_deadline():
+    limiter = StageLimiter("test", 1, max_wait=5)
+    release = hold_slots(limiter, 1)
+    try:
+        start = time.monotonic()
+        with pytest.raises(DeadlineExceeded, match="waiting for test"):
+            with limiter.slot(Deadline(0.1)):
+                pass
+        assert time.monotonic() - start < 1
+    finally:
+        release.set()
+
+
+def test_expired_deadline_gets_no_slot(clock):
+    limiter = StageLimiter("test", 1)
+    deadline = Deadline(1)
+    clock.now += 2
+
+    with pytest.raises(DeadlineExceeded):
+        with limiter.slot(deadline):
+            pass
@@ -0,0 +1,138 @@
+import math
+
+import pytest
+
+import model_policy
+from model_policy import AdaptiveModelPolicy, ModelTier, parse_tiers
+
+
+class FakeClock:
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(model_policy.time, "monotonic", clock)
+    return clock
+
+
+def make_policy(**kwargs) -> AdaptiveModelPolicy:
+    return AdaptiveModelPolicy(parse_tiers("big@512,medium@256,small@128"), **kwargs)
+
+
+def test_parse_tiers():
+    assert parse_tiers(" big@512, small ,") == [
+        ModelTier(model="big", num_predict=512),
+        ModelTier(model="small", num_predict=-1),
+    ]
+    with pytest.raises(ValueError):
+        parse_tiers(" , ")
+
+
+def test_queue_depth_moves_down_one_tier_per_step():
+    policy = make_policy(queue_depth_step=2)
+
+    assert policy.choose(0).model == "big"
+    assert policy.choose(1.5).model == "big"
+    assert policy.choose(2).model == "medium"
+    assert policy.choose(4).model == "small"
+    assert policy.choose(100).model == "small"
+    assert policy.choose(0).reason == "normal load"
+
+
+def test_slow_recent_generations_move_down_one_tier():
+    policy = make_policy(max_p95_ms=20000)
+    for _ in range(10):
+        policy.record("big", 25000)
+
+    choice = policy.choose(0)
+    assert choice.model == "medium"
+    assert "p95 25000 ms > 20000 ms" in choice.reason
+
+
+def test_tier_that_doesnt_fit_the_time_left_is_skipped():
+    policy = make_policy(max_p95_ms=60000)
+    policy.record("big", 40000)
+    policy.record("medium", 20000)
+    policy.record("small", 1000)
+
+    assert policy.choose(0, remaining_seconds=60).model == "big"
+    assert policy.choose(0, remaining_seconds=30).model == "medium"
+    choice = policy.choose(0, remaining_seconds=10)
+    assert choice.model == "small"
+    assert choice.num_predict == 128
+
+
+def test_timeout_counts_as_infinitely_slow():
+    policy = make_policy(max_p95_ms=math.inf)
+    policy.record_timeout("big")
+
+    choice = policy.choose(0, remaining_seconds=3600)
+    assert choice.model == "medium"
+    assert "big p95 inf ms" in choice.reason
+
+
+def test_num_predict_is_scaled_to_the_time_left_on_the_last_tier():
+    policy = AdaptiveModelPolicy(parse_tiers("small@256"), min_num_predict=64)
+    policy.record("small", 20000)
+
+    choice = policy.choose(0, remaining_seconds=10)
+    assert (choice.model, choice.num_predict) == ("small", 128)
+    assert "num_predict cut to 128" in choice.reason
+    assert policy.choose(0, remaining_seconds=1).num_predict == 64
+    assert policy.choose(0, remaining_seconds=30).num_predict == 256
+
+
+def test_num_predict_left_to_the_model_is_not_scaled():
+    policy = AdaptiveModelPolicy(parse_tiers("small"))
+    policy.record("small", 20000)
+
+    assert policy.choose(0, remaining_seconds=10).num_predict == -1
+
+
+def test_skipped_tier_is_probed():
+    policy = make_policy(probe_every=20, max_p95_ms=60000)
+    policy.record("big", 40000)
+
+    choices = [policy.choose(0, remaining_seconds=30) for _ in range(40)]
+    assert [i for i, choice in enumerate(choices) if choice.model == "big"] == [19, 39]
+
+    probe = choices[19]
+    assert probe.num_predict == 512
+    assert probe.reason.startswith("probing big")
+
+
+def test_one_slow_sample_does_not_lock_out_the_large_model(clock):
+    # One cold load of "big", then a request every 2 s with a 30 s budget
+    policy = AdaptiveModelPolicy(parse_tiers("big@512,small@256"))
+    policy.record("big", 40000)
+    chosen = []
+    for _ in range(200):
+        choice = policy.choose(0, remaining_seconds=30)
+        chosen.append(choice.model)
+        policy.record(choice.model, 500 if choice.model == "small" else 5000)
+        clock.now += 2
+
+    # Probed while the cold sample is kept, back to normal once it expired
+    assert chosen[0] == "small"
+    assert "big" in chosen[:150]
+    assert set(chosen[160:]) == {"big"}
+
+
+def test_samples_expire(clock):
+    policy = make_policy(sample_ttl_seconds=300, max_p95_ms=20000)
+    policy.record("big", 40000)
+    assert policy.choose(0, remaining_seconds=30).model == "medium"
+
+    clock.now += 299
+    assert policy.choose(0, remaining_seconds=30).model == "medium"
+
+    clock.now += 2
+    choice = policy.choose(0, remaining_seconds=30)
+    assert choice.model == "big"
+    assert choice.reason == "normal load"
@@ -0,0 +1,185 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from admission import Deadline
+from ollama_client import NoBackendAvailable, OllamaPool
+
+
+class FakeOllamaHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        self.wfile.write(b'{"models": []}')
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        fake = self.server
+        with fake.lock:
+            fake.generate_calls += 1
+        time.sleep(fake.delay)
+
+        if fake.status != 200:
+            self.send_response(fake.status)
+            self.end_headers()
+            self.wfile.write(json.dumps({"error": "fake error"}).encode())
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.end_headers()
+        for token in fake.tokens:
+            self.wfile.write(json.dumps({"response": token, "done": False}).encode() + b"\n")
+            self.wfile.flush()
+        if not fake.truncate:
+            self.wfile.write(json.dumps({"response": "", "done": True}).encode() + b"\n")
+
+
+class FakeOllama(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, status: int = 200, tokens=("hel", "lo"), truncate: bool = False, delay: float = 0):
+        super().__init__(("127.0.0.1", 0), FakeOllamaHandler)
+        self.status = status
+        self.delay = delay
+        self.tokens = tokens
+        self.truncate = truncate
+        self.generate_calls = 0
+        self.lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+@pytest.fixture
+def fake_servers():
+    servers = []
+
+    def start(**kwargs) -> FakeOllama:
+        server = FakeOllama(**kwargs)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def make_pool(*servers: FakeOllama) -> OllamaPool:
+    return OllamaPool([server.url for server in servers], health_check_interval=3600, cooldown_seconds=60)
+
+
+def generate_text(pool: OllamaPool, timeout: float = 5, deadline: Deadline = None) -> str:
+    stream = pool.generate({"model": "fake", "prompt": "hi"}, timeout=timeout, deadline=deadline)
+    return "".join(chunk.get("response", "") for chunk in stream)
+
+
+def test_routes_to_backend_with_fewest_outstanding_requests(fake_servers):
+    first, second = fake_servers(), fake_servers()
+    pool = make_pool(first, second)
+
+    stream = pool.generate({"model": "fake", "prompt": "hi"}, timeout=5)
+    next(stream)  # keeps one request outstanding on the first backend
+    assert generate_text(pool) == "hello"
+    stream.close()
+
+    assert (first.generate_calls, second.generate_calls) == (1, 1)
+    assert pool.in_flight() == 0
+
+
+def test_retries_on_another_backend_before_the_first_token(fake_servers):
+    broken, healthy = fake_servers(status=500), fake_servers()
+    pool = make_pool(broken, healthy)
+
+    assert generate_text(pool) == "hello"
+
+    broken_metrics, healthy_metrics = pool.metrics()
+    assert broken.generate_calls == 1 and broken_metrics["failures"] == 1
+    assert healthy_metrics["failures"] == 0
+
+
+def test_circuit_opens_after_consecutive_failures(fake_servers):
+    broken = fake_servers(status=503)
+    pool = make_pool(broken)
+
+    for _ in range(pool.failure_threshold):
+        with pytest.raises(requests.exceptions.HTTPError):
+            generate_text(pool)
+    assert pool.metrics()[0]["circuit_open"]
+
+    with pytest.raises(NoBackendAvailable):
+        generate_text(pool)
+    assert broken.generate_calls == pool.failure_threshold
+
+
+def test_client_errors_are_not_retried_nor_counted(fake_servers):
+    missing_model, other = fake_servers(status=404), fake_servers()
+    pool = make_pool(missing_model, other)
+
+    for _ in range(pool.failure_threshold + 1):
+        with pytest.raises(requests.exceptions.HTTPError):
+            generate_text(pool)
+
+    assert other.generate_calls == 0
+    metrics = pool.metrics()[0]
+    assert metrics["failures"] == 0 and not metrics["circuit_open"]
+
+
+def test_truncated_stream_is_a_backend_failure(fake_servers):
+    truncated = fake_servers(tokens=("hel",), truncate=True)
+    pool = make_pool(truncated)
+
+    with pytest.raises(requests.exceptions.ChunkedEncodingError):
+        generate_text(pool)
+
+    metrics = pool.metrics()[0]
+    assert metrics["failures"] == 1
+    assert metrics["latency_ms_p95"] == 0.0
+
+
+def test_generate_json_waits_for_an_object_with_the_required_keys(fake_servers):
+    schema = {
+        "type": "object",
+        "properties": {"recipe": {"type": "string"}, "brands": {"type": "array", "items": {"type": "string"}}},
+        "required": ["recipe", "brands"],
+    }
+    server = fake_servers(tokens=('{"recipe": "soup"}', ' {"recipe": "soup", ', '"brands": []}', " and more"))
+    pool = make_pool(server)
+
+    assert pool.generate_json({"model": "fake", "prompt": "hi"}, schema, timeout=5) == {"recipe": "soup", "brands": []}
+
+
+def test_timeouts_caused_by_the_deadline_dont_open_the_circuit(fake_servers):
+    slow = fake_servers(delay=1)
+    pool = make_pool(slow)
+
+    for _ in range(pool.failure_threshold):
+        with pytest.raises(requests.exceptions.Timeout):
+            generate_text(pool, deadline=Deadline(0.3))
+
+    metrics = pool.metrics()[0]
+    assert metrics["failures"] == 0 and not metrics["circuit_open"]
+    assert generate_text(pool) == "hello"
+
+
+def test_no_retry_past_the_deadline(fake_servers):
+    first, second = fake_servers(delay=1), fake_servers(delay=1)
+    pool = make_pool(first, second)
+
+    start = time.monotonic()
+    with pytest.raises(requests.exceptions.Timeout):
+        generate_text(pool, deadline=Deadline(0.3))
+
+    assert time.monotonic() - start < 0.8
+    assert first.generate_calls + second.generate_calls == 1
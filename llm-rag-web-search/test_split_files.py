@@ -0,0 +1,112 @@
+import os
+import shutil
+
+import pytest
+
+import utils
+from utils import recombine_files, split_file
+
+CHUNK_SIZE = 64 * 1024
+
+
+@pytest.fixture
+def source(tmp_path):
+    path = tmp_path / "weights.bin"
+    path.write_bytes(os.urandom(10 * CHUNK_SIZE + 123))
+    return path
+
+
+def count_copies(monkeypatch, fail_after: int = None) -> dict:
+    """Count _copy_range calls, optionally failing every call after `fail_after`."""
+    calls = {"count": 0}
+    copy_range = utils._copy_range
+
+    def counting(*args):
+        calls["count"] += 1
+        if fail_after is not None and calls["count"] > fail_after:
+            raise OSError("disk gone")
+        return copy_range(*args)
+
+    monkeypatch.setattr(utils, "_copy_range", counting)
+    return calls
+
+
+def test_round_trip_with_str_paths(source, tmp_path):
+    split_file(str(source), str(tmp_path / "parts"), CHUNK_SIZE)
+    recombine_files(str(tmp_path / "parts"), str(tmp_path / "out.bin"))
+
+    assert (tmp_path / "out.bin").read_bytes() == source.read_bytes()
+    assert not (tmp_path / "out.bin.progress").exists()
+
+
+def test_round_trip_without_positional_io(source, tmp_path, monkeypatch):
+    monkeypatch.setattr(utils, "POSITIONAL_IO", False)
+
+    split_file(source, tmp_path / "parts", CHUNK_SIZE)
+    recombine_files(tmp_path / "parts", tmp_path / "out.bin")
+
+    assert (tmp_path / "out.bin").read_bytes() == source.read_bytes()
+
+
+def test_corrupted_part_is_rejected(source, tmp_path):
+    split_file(source, tmp_path / "parts", CHUNK_SIZE)
+    with open(tmp_path / "parts" / "0003.part", "r+b") as f:
+        f.write(b"x")
+
+    with pytest.raises(ValueError, match="checksum mismatch"):
+        recombine_files(tmp_path / "parts", tmp_path / "out.bin")
+
+
+def test_resume_copies_only_missing_parts(source, tmp_path, monkeypatch):
+    split_file(source, tmp_path / "parts", CHUNK_SIZE)
+
+    with monkeypatch.context() as m:
+        count_copies(m, fail_after=4)
+        with pytest.raises(OSError):
+            recombine_files(tmp_path / "parts", tmp_path / "out.bin", workers=1)
+
+    calls = count_copies(monkeypatch)
+    recombine_files(tmp_path / "parts", tmp_path / "out.bin")
+
+    assert calls["count"] == 11 - 4
+    assert (tmp_path / "out.bin").read_bytes() == source.read_bytes()
+
+
+def test_progress_of_a_previous_split_is_ignored(source, tmp_path, monkeypatch):
+    split_file(source, tmp_path / "parts", CHUNK_SIZE)
+    with monkeypatch.context() as m:
+        count_copies(m, fail_after=4)
+        with pytest.raises(OSError):
+            recombine_files(tmp_path / "parts", tmp_path / "out.bin", workers=1)
+
+    # Same part names and sizes, different content
+    other = tmp_path / "other.bin"
+    other.write_bytes(os.urandom(source.stat().st_size))
+    shutil.rmtree(tmp_path / "parts")
+    split_file(other, tmp_path / "parts", CHUNK_SIZE)
+
+    calls = count_copies(monkeypatch)
+    recombine_files(tmp_path / "parts", tmp_path / "out.bin")
+
+    assert calls["count"] == 11
+    assert (tmp_path / "out.bin").read_bytes() == other.read_bytes()
+
+
+def test_journaled_part_with_another_hash_is_copied_again(source, tmp_path, monkeypatch):
+    split_file(source, tmp_path / "parts", CHUNK_SIZE)
+    with monkeypatch.context() as m:
+        count_copies(m, fail_after=4)
+        with pytest.raises(OSError):
+            recombine_files(tmp_path / "parts", tmp_path / "out.bin", workers=1)
+
+    progress = tmp_path / "out.bin.progress"
+    lines = progress.read_text().splitlines()
+    name, _ = lines[1].split(" ")
+    lines[1] = f"{name} {'0' * 64}"
+    progress.write_text("\n".join(lines) + "\n")
+
+    calls = count_copies(monkeypatch)
+    recombine_files(tmp_path / "parts", tmp_path / "out.bin")
+
+    assert calls["count"] == 11 - 3
+    assert (tmp_path / "out.bin").read_bytes() == source.read_bytes()
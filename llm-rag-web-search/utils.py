@@ -1,12 +1,15 @@
 import ast
+import hashlib
 import json
 import os
 import re
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
-from typing import List
+from typing import List, Optional
 
-from pydantic import BaseModel
+from pydantic import BaseModel, PrivateAttr
 from tqdm import tqdm
 
 
@@ -19,31 +22,55 @@ class ScratchpadEntry(BaseModel):
 
 
 class Scratchpad(BaseModel):
+    """Agent steps and their results.
+
+    The rendered representations are cached and extended as entries are
+    added, so rendering after every step only formats the new entries (the
+    cached string itself is still copied once per render).
+    Entries may only be appended (through `add`), not edited in place.
+    """
+
     entries: List[ScratchpadEntry] = []
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+    _rendered: dict = PrivateAttr(default_factory=dict)
 
     def is_empty(self) -> bool:
         return len(self.entries) == 0
 
     def clear(self):
-        self.entries = []
+        with self._lock:
+            self.entries = []
+            self._rendered = {}
 
     def copy(self) -> "Scratchpad":
         return Scratchpad(entries=self.entries.copy())
 
     def add(self, task: str, result: str):
-        self.entries.append(ScratchpadEntry(task=task, result=result))
+        with self._lock:
+            self.entries.append(ScratchpadEntry(task=task, result=result))
+
+    def _render(self, key: str, render_entry, separator: str) -> str:
+        with self._lock:
+            count, text = self._rendered.get(key, (0, ""))
+            if count > len(self.entries):
+                count, text = 0, ""
+            new = separator.join(render_entry(entry) for entry in self.entries[count:])
+            if new:
+                text = f"{text}{separator}{new}" if count else new
+            self._rendered[key] = (len(self.entries), text)
+            return text
 
     def entries_repr(self) -> str:
         if self.is_empty():
             return "<no previous steps available>"
         else:
-            return "\n\n".join(str(entry) for entry in self.entries)
+            return self._render("entries", str, "\n\n")
 
     def results_repr(self) -> str:
         if self.is_empty():
             return "<no context information available>"
         else:
-            return "\n".join([se.result for se in self.entries])
+            return self._render("results", lambda entry: entry.result, "\n")
 
 
 class StopWatch:
@@ -101,6 +128,81 @@ def extract_json(s: str) -> dict:
     return json.loads(match.group(1))
 
 
+class JsonStreamParser:
+    """Finds the first complete top-level JSON object in text that arrives in pieces.
+
+    `feed` returns the parsed object as soon as its closing brace arrives, so
+    a streamed generation can be cancelled right there.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self._pos = 0
+        self._start = -1
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+
+    def feed(self, text: str):
+        self.buffer += text
+        while self._pos < len(self.buffer):
+            c = self.buffer[self._pos]
+            self._pos += 1
+            if self._start < 0:
+                if c == "{":
+                    self._start, self._depth = self._pos - 1, 1
+                continue
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+            elif c == '"':
+                self._in_string = True
+            elif c in "{[":
+                self._depth += 1
+            elif c in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    start, self._start = self._start, -1
+                    try:
+                        return json.loads(self.buffer[start : self._pos])
+                    except json.JSONDecodeError:
+                        # Not an object after all, look for the next one
+                        self._pos = start + 1
+        return None
+
+
+def missing_required(obj, schema, path: str = "") -> List[str]:
+    """Paths of the `required` keys of `schema` (and of its nested objects) missing from `obj`."""
+    missing = []
+    if "properties" in schema:
+        if not isinstance(obj, dict):
+            return [path or "<root>"]
+        for key in schema.get("required", []):
+            if key not in obj:
+                missing.append(f"{path}.{key}" if path else key)
+        for key, value in schema["properties"].items():
+            if key in obj:
+                missing += missing_required(obj[key], value, f"{path}.{key}" if path else key)
+    elif "items" in schema and isinstance(obj, list):
+        for i, item in enumerate(obj):
+            missing += missing_required(item, schema["items"], f"{path}[{i}]")
+    return missing
+
+
+def schema_instructions(schema) -> str:
+    """Prompt suffix asking for a JSON object of the given schema, top-level keys in schema order."""
+    example = json.dumps(object_from_schema(schema), indent=2)
+    keys = ", ".join(schema.get("properties", {}))
+    return (
+        "Respond only with a JSON object of the following form, "
+        f"with the keys in this order: {keys}.\n{example}"
+    )
+
+
 def extract_code(s: str, remove_print_statements: bool = False) -> str:
     match = re.search(r"```python(.*?)```", s, re.DOTALL)
     if not match:
@@ -129,11 +231,13 @@ def _remove_print_statements(code: str) -> str:
     return f"\n{ast.unparse(tree)}\n"
 
 
-def exec_code(code: str, result_variable_name: str):
+def exec_code(code: str, result_variable_name: str, timeout: Optional[float] = None):
+    """Run untrusted code in a sandboxed worker process and return one of its globals."""
+    # exec_pool needs the POSIX-only `resource` module, so only import it when code is run
+    from exec_pool import get_default_exec_pool
+
     try:
-        global_variables = {}  # type: ignore
-        exec(code, global_variables)
-        return global_variables[result_variable_name]
+        return get_default_exec_pool().run(code, result_variable_name, timeout=timeout)
     except Exception as e:
         raise ValueError(f"code could not be executed (code='{code}')", e)
 
@@ -147,24 +251,172 @@ def parse_function_call(call):
             return args, kwargs
 
 
-def split_file(file_path: Path, output_dir: Path, chunk_size: int) -> None:
+SPLIT_MANIFEST_NAME = "manifest.json"
+COPY_BLOCK_SIZE = 4 * 1024 * 1024
+# Windows has no preadv/pwrite: parts are then copied one at a time with seek + read/write
+POSITIONAL_IO = hasattr(os, "preadv") and hasattr(os, "pwrite")
+O_BINARY = getattr(os, "O_BINARY", 0)
+
+
+def _read_at(fd: int, view: memoryview, offset: int) -> int:
+    if POSITIONAL_IO:
+        return os.preadv(fd, [view], offset)
+    os.lseek(fd, offset, os.SEEK_SET)
+    data = os.read(fd, len(view))
+    view[: len(data)] = data
+    return len(data)
+
+
+def _write_at(fd: int, view: memoryview, offset: int) -> int:
+    if POSITIONAL_IO:
+        return os.pwrite(fd, view, offset)
+    os.lseek(fd, offset, os.SEEK_SET)
+    return os.write(fd, view)
+
+
+def _copy_range(src_fd: int, src_offset: int, dst_fd: int, dst_offset: int, length: int, buffer: bytearray) -> str:
+    """Copy `length` bytes between file descriptors through `buffer`, returning their sha256."""
+    digest = hashlib.sha256()
+    view = memoryview(buffer)
+    copied = 0
+    while copied < length:
+        n = _read_at(src_fd, view[: min(len(buffer), length - copied)], src_offset + copied)
+        if n == 0:
+            raise ValueError(f"unexpected end of file after {copied} of {length} bytes")
+        digest.update(view[:n])
+        written = 0
+        while written < n:
+            written += _write_at(dst_fd, view[written:n], dst_offset + copied + written)
+        copied += n
+    return digest.hexdigest()
+
+
+def _digest_of_parts(parts: List[dict]) -> str:
+    """Whole-file digest: sha256 over the concatenated part digests, so parts can be hashed in parallel."""
+    return hashlib.sha256("".join(part["sha256"] for part in parts).encode()).hexdigest()
+
+
+def split_file(file_path: Path, output_dir: Path, chunk_size: int, workers: int = 4) -> dict:
+    """Split a file into `chunk_size` parts written in parallel, plus a manifest of their hashes."""
+    output_dir = Path(output_dir)
+    workers = workers if POSITIONAL_IO else 1
     if not output_dir.exists():
         output_dir.mkdir(parents=True)
 
-    with open(file_path, "rb") as input_file:
-        part_num = 0
-        while True:
-            chunk = input_file.read(chunk_size)
-            if not chunk:
-                break
-            part_num += 1
-            with open(output_dir / f"{part_num:04d}.part", "wb") as output_file:
-                output_file.write(chunk)
-
-
-def recombine_files(input_dir: Path, output_file: Path) -> None:
-    with open(output_file, "wb") as output:
-        parts = sorted(os.listdir(input_dir))
-        for part in tqdm(parts):
-            with open(input_dir / part, "rb") as input_file:
-                output.write(input_file.read())
\ No newline at end of file
+    size = os.path.getsize(file_path)
+    parts = [
+        {"name": f"{part_num + 1:04d}.part", "offset": offset, "size": min(chunk_size, size - offset)}
+        for part_num, offset in enumerate(range(0, size, chunk_size))
+    ]
+
+    src_fd = os.open(file_path, os.O_RDONLY | O_BINARY)
+    try:
+
+        def write_part(part: dict):
+            buffer = bytearray(min(COPY_BLOCK_SIZE, part["size"]))
+            dst_fd = os.open(output_dir / part["name"], os.O_WRONLY | os.O_CREAT | os.O_TRUNC | O_BINARY, 0o644)
+            try:
+                part["sha256"] = _copy_range(src_fd, part["offset"], dst_fd, 0, part["size"], buffer)
+            finally:
+                os.close(dst_fd)
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(tqdm(executor.map(write_part, parts), total=len(parts)))
+    finally:
+        os.close(src_fd)
+
+    manifest = {
+        "file_name": Path(file_path).name,
+        "size": size,
+        "chunk_size": chunk_size,
+        "parts": parts,
+        "sha256_of_parts": _digest_of_parts(parts),
+    }
+    with open(output_dir / SPLIT_MANIFEST_NAME, "w") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def _parts_without_manifest(input_dir: Path) -> List[dict]:
+    """Part layout of a directory written before manifests existed; no hashes to verify."""
+    parts = []
+    offset = 0
+    for name in sorted(os.listdir(input_dir)):
+        size = os.path.getsize(input_dir / name)
+        parts.append({"name": name, "offset": offset, "size": size})
+        offset += size
+    return parts
+
+
+def _read_progress(progress_path: Path, layout_digest: str, parts: List[dict]) -> set:
+    """Names of the parts a previous run finished, if it recombined the same layout."""
+    lines = progress_path.read_text().splitlines()
+    if not lines or lines[0] != f"layout {layout_digest}":
+        return set()
+    expected = {part["name"]: part.get("sha256") for part in parts}
+    done = set()
+    for line in lines[1:]:
+        name, _, digest = line.partition(" ")
+        if name in expected and expected[name] in (None, digest):
+            done.add(name)
+    return done
+
+
+def recombine_files(input_dir: Path, output_file: Path, workers: int = 4) -> None:
+    """Recombine parts in parallel at their offsets, verifying them against the manifest.
+
+    Finished parts and their hashes are journaled next to the output file, so
+    calling this again after a failure only copies the parts that are still
+    missing. The journal is ignored if the parts have changed since.
+    """
+    input_dir, output_file = Path(input_dir), Path(output_file)
+    workers = workers if POSITIONAL_IO else 1
+    manifest_path = input_dir / SPLIT_MANIFEST_NAME
+    if manifest_path.exists():
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        parts = manifest["parts"]
+        layout_digest = manifest["sha256_of_parts"]
+        if _digest_of_parts(parts) != layout_digest:
+            raise ValueError(f"manifest is inconsistent (manifest='{manifest_path}')")
+    else:
+        parts = _parts_without_manifest(input_dir)
+        layout_digest = hashlib.sha256(json.dumps(parts).encode()).hexdigest()
+    total_size = sum(part["size"] for part in parts)
+
+    progress_path = output_file.with_name(output_file.name + ".progress")
+    done = set()
+    if progress_path.exists() and output_file.exists():
+        done = _read_progress(progress_path, layout_digest, parts)
+    pending = [part for part in parts if part["name"] not in done]
+
+    dst_fd = os.open(output_file, os.O_RDWR | os.O_CREAT | O_BINARY | (0 if done else os.O_TRUNC), 0o644)
+    progress_lock = threading.Lock()
+    try:
+        os.ftruncate(dst_fd, total_size)
+        with open(progress_path, "a" if done else "w") as progress:
+            if not done:
+                progress.write(f"layout {layout_digest}\n")
+                progress.flush()
+
+            def copy_part(part: dict):
+                buffer = bytearray(min(COPY_BLOCK_SIZE, max(part["size"], 1)))
+                src_fd = os.open(input_dir / part["name"], os.O_RDONLY | O_BINARY)
+                try:
+                    digest = _copy_range(src_fd, 0, dst_fd, part["offset"], part["size"], buffer)
+                finally:
+                    os.close(src_fd)
+                if "sha256" in part and digest != part["sha256"]:
+                    raise ValueError(f"checksum mismatch (part='{part['name']}')")
+                with progress_lock:
+                    progress.write(f"{part['name']} {digest}\n")
+                    progress.flush()
+
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = [executor.submit(copy_part, part) for part in pending]
+                for future in tqdm(as_completed(futures), total=len(futures)):
+                    future.result()
+    finally:
+        os.close(dst_fd)
+
+    progress_path.unlink()
@@ -1,16 +1,21 @@
-from flask import Flask, request, render_template_string, jsonify
+import time
+_PROCESS_START = time.perf_counter()
+
+from flask import Flask, g, request, render_template_string, jsonify
 import re
 import requests
 import logging
 import os
 from typing import List, Tuple
 import uuid
+import threading
+import importlib
 from utils import StopWatch
-import pytesseract
-from PIL import Image
-import json
-import easyocr
-import cv2
+from alternatives import AlternativesTable, normalize_grade
+from admission import Deadline, DeadlineExceeded, Overloaded, StageLimiter, install_admission_control
+from serving import SHOPPING_SCHEMA, generate_answer, install_health_routes, start_warm_up, warm_up_models
+
+# Heavy OCR dependencies (easyocr, cv2, pytesseract) are imported lazily on first use
 
 # Logging configuration
 logging.basicConfig(level=logging.INFO)
@@ -28,6 +33,18 @@ Question: {question}
 
 Answer:"""
 
+# Used when the alternatives table already provides better graded brands
+QA_USER_PROMPT_TEMPLATE_SHOPPING_RECIPE = """You are an eco-shopping assistant designed to assist users in making better shopping decisions. 
+The user will enter the name of an item they are looking to purchase. 
+Given the context information and using prior knowledge, precisely provide exactly one simple homemade recipe, as a healthy alternative, for the user to try instead.
+Avoid formal phrases like "based on the context information" or "from the provided data", as well as information about the item. Keep your tone friendly and helpful.
+Context information is below. Each line is a separate document from the internet about a specific topic or person.
+{context}
+
+Question: {question}
+
+Answer:"""
+
 QA_USER_PROMPT_TEMPLATE_RECYCLING = """You are an eco-recycling assistant designed to assist users in making more of their waste. 
 The user will enter the name of an item they are looking to recycle. 
 Given the context information and using prior knowledge, precisely provide exactly one simple method to recycle the item into something innovative.
@@ -40,10 +57,54 @@ Question: {question}
 
 Answer:"""
 
+# Schemas of the structured (format=json) answers, SHOPPING_SCHEMA lives in serving
+RECIPE_SCHEMA = {
+    "type": "object",
+    "properties": {"recipe": SHOPPING_SCHEMA["properties"]["recipe"]},
+    "required": ["recipe"],
+}
+
+RECYCLING_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "recycling_idea": {
+            "type": "object",
+            "properties": {
+                "name": {"type": "string", "description": "what the item is turned into"},
+                "steps": {"type": "array", "items": {"type": "string", "description": "step"}},
+            },
+            "required": ["name", "steps"],
+        },
+        "disposal": {"type": "string", "description": "how to dispose of the item safely"},
+    },
+    "required": ["recycling_idea", "disposal"],
+}
+
+# Admission control: requests beyond MAX_IN_FLIGHT get a 429, a saturated stage a 503
+MAX_IN_FLIGHT = int(os.environ.get("MAX_IN_FLIGHT", 32))
+REQUEST_BUDGET_SECONDS = float(os.environ.get("REQUEST_BUDGET_SECONDS", 45))
+OCR_STAGE = StageLimiter("ocr", int(os.environ.get("OCR_CONCURRENCY", 2)))
+SCRAPE_STAGE = StageLimiter("openfoodfacts", int(os.environ.get("SCRAPE_CONCURRENCY", 8)))
+
+# Per-call caps, further shortened by the request deadline
+SCRAPE_TIMEOUT_SECONDS = 10
+OCR_SLOW_PASS_MIN_SECONDS = 5  # skip EasyOCR when less time than this is left
+
 # Real time webscraping
-def get_eco_score(product_name):
+def get_eco_score(product_name, deadline: Deadline):
+    try:
+        with SCRAPE_STAGE.slot(deadline):
+            return _get_eco_score(product_name, deadline)
+    except (requests.exceptions.RequestException, DeadlineExceeded) as e:
+        logger.error(f"Request error querying OpenFoodFacts: {e}")
+        return "Eco-Score not found"
+
+def _get_eco_score(product_name, deadline: Deadline):
     # Search for the product on OpenFoodFacts
-    x = requests.get(f'https://world.openfoodfacts.org/cgi/search.pl?action=process&search_terms={product_name}&sort_by=unique_scans_n&page_size=50?sort_by=environmental_score_score')
+    x = requests.get(
+        f'https://world.openfoodfacts.org/cgi/search.pl?action=process&search_terms={product_name}&sort_by=unique_scans_n&page_size=50?sort_by=environmental_score_score',
+        timeout=deadline.timeout(SCRAPE_TIMEOUT_SECONDS)
+    )
     
     pattern = r'"url":"https://world\.openfoodfacts\.org/product/[^\s">]+"'
     matches = re.finditer(pattern, x.text)
@@ -60,7 +121,7 @@ def get_eco_score(product_name):
     print(f"Product URL: {url[7:-1]}")
 
     # Fetch the product page
-    x = requests.get(url[7:-1])  # Fetch the product page
+    x = requests.get(url[7:-1], timeout=deadline.timeout(SCRAPE_TIMEOUT_SECONDS))  # Fetch the product page
 
     # Regex pattern to extract Eco-Score information
     eco_score_pattern = r'\bGreen-Score\b(?:\s+[A-F][+-]?)'
@@ -72,99 +133,243 @@ def get_eco_score(product_name):
 
     return "Eco-Score not found"
 
-# Function to extract headings using EasyOCR
-def extract_heading(image_path):
-    # Initialize EasyOCR Reader
-    reader = easyocr.Reader(['en'])
-
-    # Load the image using OpenCV
-    image = cv2.imread(image_path)
-
+# OCR tuning
+OCR_HEADING_MIN_HEIGHT = 50  # px at original resolution, adjust as per image resolution
+OCR_FAST_MAX_SIDE = 1024  # longest side of the thumbnail used by the fast pass
+OCR_FAST_MIN_CONFIDENCE = float(os.environ.get("OCR_FAST_MIN_CONFIDENCE", 80))  # Tesseract confidence, 0-100
+OCR_CROP_PADDING = 8  # px added around each heading region before recognition
+
+_easyocr_reader = None
+_easyocr_lock = threading.Lock()
+
+def get_easyocr_reader():
+    """Create the EasyOCR reader once and reuse it across requests."""
+    global _easyocr_reader
+    with _easyocr_lock:
+        if _easyocr_reader is None:
+            import easyocr
+            _easyocr_reader = easyocr.Reader(['en'])
+    return _easyocr_reader
+
+def fast_ocr_headings(image) -> Tuple[List[str], float, List[List[int]]]:
+    """Cheap Tesseract pass on a downscaled, binarized copy of the image.
+
+    Returns the heading words, their mean confidence and the heading line
+    boxes as [x_min, x_max, y_min, y_max] in original image coordinates.
+    """
+    import cv2
+    import pytesseract
+
+    height, width = image.shape[:2]
+    scale = min(1.0, OCR_FAST_MAX_SIDE / max(height, width))
+
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    if scale < 1.0:
+        gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+
+    data = pytesseract.image_to_data(binary, output_type=pytesseract.Output.DICT)
+
+    words = []
+    confidences = []
+    lines = {}
+    for i, text in enumerate(data["text"]):
+        confidence = float(data["conf"][i])
+        if not text.strip() or confidence < 0:
+            continue
+
+        # Consider text with large height (at original resolution) as heading
+        if data["height"][i] / scale <= OCR_HEADING_MIN_HEIGHT:
+            continue
+
+        words.append(text)
+        confidences.append(confidence)
+
+        # Merge word boxes into one box per Tesseract line
+        left, top = data["left"][i], data["top"][i]
+        right, bottom = left + data["width"][i], top + data["height"][i]
+        key = (data["block_num"][i], data["par_num"][i], data["line_num"][i])
+        if key in lines:
+            box = lines[key]
+            lines[key] = [min(box[0], left), max(box[1], right), min(box[2], top), max(box[3], bottom)]
+        else:
+            lines[key] = [left, right, top, bottom]
+
+    boxes = []
+    for x_min, x_max, y_min, y_max in lines.values():
+        boxes.append([
+            max(0, int(x_min / scale) - OCR_CROP_PADDING),
+            min(width, int(x_max / scale) + OCR_CROP_PADDING),
+            max(0, int(y_min / scale) - OCR_CROP_PADDING),
+            min(height, int(y_max / scale) + OCR_CROP_PADDING),
+        ])
+
+    mean_confidence = sum(confidences) / len(confidences) if confidences else 0.0
+    return words, mean_confidence, boxes
+
+def easyocr_headings(image) -> List[str]:
+    """Full EasyOCR detection and recognition, keeping only large text."""
     # Get OCR results with bounding box details
-    results = reader.readtext(image, detail=1)
+    results = get_easyocr_reader().readtext(image, detail=1)
 
     # Filter results based on text size (to focus on headings)
     headings = []
     for bbox, text, confidence in results:
         # Calculate box height
         box_height = abs(bbox[0][1] - bbox[2][1])
-        
+
         # Consider text with large height as heading
-        if box_height > 50:  # Adjust threshold as per image resolution
+        if box_height > OCR_HEADING_MIN_HEIGHT:
             headings.append(text)
 
+    return headings
+
+def easyocr_regions(image, boxes: List[List[int]]) -> List[str]:
+    """Run EasyOCR recognition only on the given heading regions, skipping detection."""
+    import cv2
+
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    results = get_easyocr_reader().recognize(gray, horizontal_list=boxes, free_list=[], detail=1)
+    return [text for _, text, _ in results if text.strip()]
+
+# Function to extract headings with a tiered OCR strategy
+def extract_heading(image_path, deadline: Deadline):
+    with OCR_STAGE.slot(deadline):
+        return _extract_heading(image_path, deadline)
+
+def _extract_heading(image_path, deadline: Deadline):
+    import cv2
+    import pytesseract
+
+    # Load the image using OpenCV
+    image = cv2.imread(image_path)
+
+    # Fast pass: Tesseract on a thumbnail finds the heading regions
+    words, confidence, boxes = [], 0.0, []
+    with StopWatch() as sw:
+        try:
+            words, confidence, boxes = fast_ocr_headings(image)
+        except (pytesseract.TesseractNotFoundError, pytesseract.TesseractError) as e:
+            logger.warning(f"Tesseract fast pass unavailable: {e}")
+    fast_ms = sw.elapsed()
+
+    if words and confidence >= OCR_FAST_MIN_CONFIDENCE:
+        logger.info("OCR path=fast confidence=%.1f regions=%d in %.1f ms", confidence, len(boxes), fast_ms)
+        return " ".join(words)
+
+    if deadline.remaining() < OCR_SLOW_PASS_MIN_SECONDS:
+        logger.info(
+            "OCR path=fast-deadline confidence=%.1f in %.1f ms, %.1fs left", confidence, fast_ms, deadline.remaining()
+        )
+        return " ".join(words)
+
+    # Slow pass: EasyOCR on the heading crops, or on the full image if none were found
+    with StopWatch() as sw:
+        path = "crops"
+        headings = easyocr_regions(image, boxes) if boxes else []
+        if not headings:
+            path = "full"
+            headings = easyocr_headings(image)
+    logger.info(
+        "OCR path=%s fast_confidence=%.1f regions=%d in %.1f ms (fast pass %.1f ms)",
+        path, confidence, len(boxes), fast_ms + sw.elapsed(), fast_ms,
+    )
+
     # Combine extracted headings
     return " ".join(headings)
 
 # Function to extract text from uploaded image using OCR
 def extract_text_from_image(image_path):
-    # Initialize EasyOCR Reader
-    reader = easyocr.Reader(['en'])
+    import cv2
 
     # Load the image using OpenCV
     image = cv2.imread(image_path)
 
-    # Get OCR results with bounding box details
-    results = reader.readtext(image, detail=1)
+    # Combine extracted headings
+    return " ".join(easyocr_headings(image))
 
-    # Filter results based on text size (to focus on headings)
-    headings = []
-    for bbox, text, confidence in results:
-        # Calculate box height
-        box_height = abs(bbox[0][1] - bbox[2][1])
-        
-        # Consider text with large height as heading
-        if box_height > 50:  # Adjust threshold as per image resolution
-            headings.append(text)
 
-    # Combine extracted headings
-    return " ".join(headings)
+# Precomputed by alternatives.py from an OpenFoodFacts export, loaded on first use
+ALTERNATIVES_TABLE_PATH = os.environ.get("ALTERNATIVES_TABLE", "alternatives.json")
+
+_alternatives_table = None
+_alternatives_lock = threading.Lock()
+
+def get_alternatives_table():
+    """The alternatives table, or None if it hasn't been built."""
+    global _alternatives_table
+    with _alternatives_lock:
+        if _alternatives_table is None and os.path.exists(ALTERNATIVES_TABLE_PATH):
+            with StopWatch() as sw:
+                _alternatives_table = AlternativesTable.load(ALTERNATIVES_TABLE_PATH)
+            logger.info("Loaded %d alternative categories in %.1f ms", len(_alternatives_table.categories), sw.elapsed())
+    return _alternatives_table
 
+def find_alternatives(product_name: str, eco_score: str) -> List[dict]:
+    """Better graded products of the same category, from the precomputed table; none for an unknown Eco-Score."""
+    table = get_alternatives_table()
+    if table is None:
+        return []
+    return table.better_alternatives(product_name, eco_score)
 
-def get_recommendations(eco_score):
+def get_recommendations(eco_score, alternatives: List[dict] = None):
     recommendations = {
-        "A": "Great choice! This product has a top Eco-Score. Consider recommending it to others!",
-        "B": "Good choice! To improve sustainability, look for alternatives with an 'A' Eco-Score.",
-        "C": "This product is average in sustainability. Explore options with a higher Eco-Score.",
-        "D": "Below average Eco-Score. Consider switching to more eco-friendly alternatives.",
-        "E": "Poor Eco-Score. It's highly recommended to find a more sustainable product."
+        "a-plus": "Excellent choice! This product has the best possible Eco-Score. Consider recommending it to others!",
+        "a": "Great choice! This product has a top Eco-Score. Consider recommending it to others!",
+        "b": "Good choice! To improve sustainability, look for alternatives with an 'A' Eco-Score.",
+        "c": "This product is average in sustainability. Explore options with a higher Eco-Score.",
+        "d": "Below average Eco-Score. Consider switching to more eco-friendly alternatives.",
+        "e": "Poor Eco-Score. It's highly recommended to find a more sustainable product.",
+        "f": "Very poor Eco-Score. Please look for a more sustainable product instead."
     }
-    score = eco_score.split()[-1] if eco_score != "Eco-Score not found" else None
-    return recommendations.get(score, "Eco-Score not found. Unable to provide recommendations.")
+    grade = normalize_grade(eco_score)
+    if grade is None:
+        return "Eco-Score not found. Unable to provide recommendations."
+    recommendation = recommendations[grade]
+    if alternatives:
+        names = ", ".join(
+            f"{p['name']} by {p['brands']} ({p['grade'].replace('-plus', '+').upper()})" if p["brands"]
+            else f"{p['name']} ({p['grade'].replace('-plus', '+').upper()})"
+            for p in alternatives
+        )
+        recommendation += f" Better rated alternatives: {names}."
+    return recommendation
+
+
+def query_ollama_local(
+    context: str,
+    question: str,
+    mode: str = "shopping",
+    model_name: str = None,
+    deadline: Deadline = None,
+    schema: dict = None,
+    with_brands: bool = True,
+    metadata: dict = None,
+):
+    """Generate a response locally using an Ollama model, see `serving.generate_answer`.
+
+    Without `with_brands` the shopping prompt only asks for the recipe.
+    """
+    if mode == "shopping":
+        prompt_template = QA_USER_PROMPT_TEMPLATE_SHOPPING if with_brands else QA_USER_PROMPT_TEMPLATE_SHOPPING_RECIPE
+    else:
+        prompt_template = QA_USER_PROMPT_TEMPLATE_RECYCLING
+    prompt = prompt_template.format(context=context, question=question)
+    return generate_answer(prompt, model_name=model_name, deadline=deadline, schema=schema, metadata=metadata)
 
+def warm_up() -> None:
+    """Load the OCR models, the alternatives table and the Ollama models so the first request doesn't pay for it."""
+    importlib.import_module("cv2")
+    importlib.import_module("pytesseract")
 
-def query_ollama_local(context: str, question: str, mode: str = "shopping", model_name: str = "llama3.2") -> str:
-    """Generate a response locally using an Ollama model."""
-    prompt_template = QA_USER_PROMPT_TEMPLATE_SHOPPING if mode == "shopping" else QA_USER_PROMPT_TEMPLATE_RECYCLING
-    prompt = prompt_template.format(context=context, question=question)
-    try:
-        response = requests.post(
-            "http://127.0.0.1:11434/api/generate",
-            json={"model": model_name, "prompt": prompt},
-            timeout=30,
-            stream=True
-        )
-        response.raise_for_status()
-
-        final_response = ""
-        for line in response.iter_lines():
-            if line:
-                try:
-                    json_line = json.loads(line)
-                    final_response += json_line.get("response", "")
-                except json.JSONDecodeError as e:
-                    logger.warning(f"Failed to parse JSON line: {line}. Error: {e}")
-
-        return final_response.strip()
-
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Request error querying Ollama: {e}")
-        return "Error generating a response."
-    except Exception as e:
-        logger.error(f"Unexpected error: {e}")
-        return "Error generating a response."
+    get_easyocr_reader()
+    get_alternatives_table()
+    warm_up_models()
 
 app = Flask(__name__)
+install_admission_control(app, MAX_IN_FLIGHT, REQUEST_BUDGET_SECONDS)
+install_health_routes(app)
+start_warm_up(warm_up, _PROCESS_START)
 
 @app.route('/get_eco_score', methods=['GET', 'POST'])
 def index():
@@ -172,6 +377,7 @@ def index():
         #takes 3 input vars from post
         product_name = request.form.get('query', '')
         Mode = request.form.get('mode', '')
+        structured = request.form.get('format', '') == 'json'
         image = request.files.get('image')
         print(f"product name received: {product_name}")
         extracted_text = ""
@@ -182,11 +388,13 @@ def index():
                 image.save(img_path)
 
                 # Extract heading 
-                extracted_text = extract_heading(img_path)
+                extracted_text = extract_heading(img_path, g.deadline)
                 product_name = extracted_text if extracted_text else product_name
 
                 # Clean up temporary file
                 #os.remove(img_path)
+            except Overloaded:
+                raise
             except Exception as e:
                 logger.error(f"Error processing image: {e}")
 
@@ -194,19 +402,33 @@ def index():
             return "no product name or valid image provided"
 
         if product_name:
-            eco_score = get_eco_score(product_name)
+            eco_score = get_eco_score(product_name, g.deadline)
         
-        recommendations = get_recommendations(eco_score)
+        alternatives = find_alternatives(product_name, eco_score)
+        recommendations = get_recommendations(eco_score, alternatives)
 
         
         context = f"Simulated context for {product_name}"
-        ollama_response = query_ollama_local(context, product_name, mode=Mode)
+        # Brands come from the alternatives table when it has any, so the LLM only writes the recipe
+        with_brands = not alternatives
+        schema = None
+        if structured and Mode == "shopping":
+            schema = SHOPPING_SCHEMA if with_brands else RECIPE_SCHEMA
+        elif structured:
+            schema = RECYCLING_SCHEMA
+        llm_metadata = {}
+        ollama_response = query_ollama_local(
+            context, product_name, mode=Mode, deadline=g.deadline, schema=schema, with_brands=with_brands,
+            metadata=llm_metadata
+        )
         
         response = {
             "product_name": product_name,
             "eco_score": eco_score,
             "recommendations": recommendations,
-            "AI_suggestions": ollama_response
+            "alternatives": alternatives,
+            "AI_suggestions": ollama_response,
+            "llm": llm_metadata
         }
 
         #response = f"Eco-Score for '{product_name}': {eco_score}\n\nRecommendations: {recommendations}\n\nAI Assistant Suggestions: {ollama_response}"